@@ -1,5 +1,6 @@
 import os
 import argparse
+import shlex
 import logging
 import time
 import json
@@ -11,11 +12,17 @@ from src.vector_db import create_vector_db
 from src.rag import RAGSystem
 from src.translate import translate_text
 from src.summarize import summarize_text, evaluate_summary
-from src.utils import measure_performance, save_text
+from src.utils import batched, count_tokens, measure_performance, save_text
 from src.extract_table_and_chunk_docx import process_file 
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_core.documents import Document
+from src.sharded_store import DEFAULT_NUM_SHARDS, ShardedVectorStore, chunks_to_documents
+from src.metadata_index import parse_filters
+from src.extract_tabular import TABULAR_EXTENSIONS, stream_tabular_chunks
+from src.quantization import DEFAULT_RESCORE_FACTOR, VECTOR_ENCODINGS, compression_report
+from src.conversation_memory import DEFAULT_MEMORY_TOKENS
+from src.model_registry import configure as configure_models, model_stats
+from src.embedding_backends import get_embedding_backend
+from src.chunk_store import ChunkStore
+from src.profiling import PROFILE_DIR, enable as enable_profiling, finish as finish_profiling, profile_stage
 
 log_path = "outputs/pipeline.log"
 os.makedirs(os.path.dirname(log_path), exist_ok=True)
@@ -28,6 +35,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Chunks embedded and added per batch when streaming CSV/Excel files
+STREAM_BATCH_CHUNKS = 256
 
 
 def init_performance_log(output_path: str = "outputs/performance.json") -> None:
@@ -38,25 +47,70 @@ def init_performance_log(output_path: str = "outputs/performance.json") -> None:
 
 
 
-def log_performance(task_name: str, tokens_per_second: float, output_path: str = "outputs/performance.json") -> None:
+def log_performance(task_name: str, tokens_per_second: float, output_path: str = "outputs/performance.json", metric: str = "tokens_per_second") -> None:
     """Append performance metrics to performance.json."""
     try:
         with open(output_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
         data = []
-    data.append({"task": task_name, "tokens_per_second": tokens_per_second, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")})
+    data.append({"task": task_name, metric: tokens_per_second, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")})
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=4)
 
 
 
-def extract_and_chunk(data_dir: str, chunks_dir: str = "outputs/chunks") -> List[dict]:
-    """Extract text from files and chunk them, measuring performance."""
-    all_chunks = []
+def find_tabular_files(data_dir: str) -> List[Path]:
+    """List CSV/Excel files, which are streamed into the vector store instead of chunked in memory."""
+    return [
+        file_path for file_path in Path(data_dir).rglob("*.*")
+        if file_path.is_file() and file_path.suffix.lower() in TABULAR_EXTENSIONS
+    ]
+
+
+
+def stream_tabular_into_vector_db(file_path: Path, vector_store: ShardedVectorStore, batch_size: int = STREAM_BATCH_CHUNKS) -> int:
+    """Stream a CSV/Excel file into the vector store batch by batch, replacing any previous version."""
+    file_path = Path(file_path)
+    stats = {}
+    with profile_stage("stream_tabular", str(file_path)):
+        vector_store.delete_file(file_path.name)
+        for batch in batched(stream_tabular_chunks(str(file_path), stats=stats), batch_size):
+            vector_store.add_documents(chunks_to_documents(batch), persist=False)
+        vector_store.flush()
+    logger.info(
+        f"Streamed {stats['rows']} rows in {stats['chunks']} chunks from {file_path} "
+        f"({stats['rows_per_second']:.0f} rows/sec)"
+    )
+    log_performance(f"stream_{file_path.name}", stats["rows_per_second"], metric="rows_per_second")
+    return stats["chunks"]
+
+
+
+def compact_chunk_store(chunks_dir: str = "outputs/chunks") -> None:
+    """Drop superseded and deleted chunks from the chunk store once they make up enough of it."""
+    if not Path(chunks_dir).exists():
+        return
+    chunk_store = ChunkStore(chunks_dir)
+    dropped = chunk_store.maybe_compact()
+    chunk_store.close()
+    if dropped:
+        logger.info(f"Compacted chunk store, dropped {dropped} superseded chunks.")
+
+
+
+def extract_and_chunk(data_dir: str, chunks_dir: str = "outputs/chunks") -> List[str]:
+    """Extract text from files and chunk them into the chunk store, measuring performance.
+
+    Returns the names of the chunked files; their chunks are read back from the store.
+    CSV/Excel files are skipped here; see find_tabular_files / stream_tabular_into_vector_db.
+    """
+    chunked_files = []
     for file_path in Path(data_dir).rglob("*.*"):
         if not file_path.is_file():
             continue
+        if file_path.suffix.lower() in TABULAR_EXTENSIONS:
+            continue
         logger.info(f"Processing file: {file_path}")
         try:
             extension = file_path.suffix.lower()
@@ -65,14 +119,16 @@ def extract_and_chunk(data_dir: str, chunks_dir: str = "outputs/chunks") -> List
                 chunks = measure_performance(
                     str(file_path),
                     lambda _: process_file(str(file_path), chunks_dir),
-                    f"extract_and_chunk_docx_{file_path.name}"
+                    f"extract_and_chunk_docx_{file_path.name}",
+                    stage="extract_and_chunk_docx"
                 )
             else:
                 # Handle other file types with text extraction
                 text = measure_performance(
                     str(file_path),
                     lambda _: extract_text_from_file(str(file_path)),
-                    f"extract_{file_path.name}"
+                    f"extract_{file_path.name}",
+                    stage="extract"
                 )
                 if not text or not text.strip():
                     logger.warning(f"Empty or failed extraction: {file_path}")
@@ -80,39 +136,70 @@ def extract_and_chunk(data_dir: str, chunks_dir: str = "outputs/chunks") -> List
                 chunks = measure_performance(
                     text,
                     lambda t: chunk_text(t, str(file_path), max_tokens=1500, overlap_tokens=100),
-                    f"chunk_{file_path.name}"
+                    f"chunk_{file_path.name}",
+                    stage="chunk"
                 )
-                save_chunks(chunks, str(file_path), chunks_dir)
+                with profile_stage("save_chunks", str(file_path)):
+                    save_chunks(chunks, str(file_path), chunks_dir)
             
             if chunks:
-                all_chunks.extend(chunks)
+                chunked_files.append(chunks[0]["file_name"])
                 logger.info(f"Extracted and chunked {len(chunks)} chunks from {file_path}")
             else:
                 logger.warning(f"No chunks created for {file_path}")
         except Exception as e:
             logger.error(f"Error processing {file_path}: {e}")
-    return all_chunks
+    # Re-processed files leave their previous chunks behind as deleted rows
+    compact_chunk_store(chunks_dir)
+    return chunked_files
+
 
 
+def build_vector_db(file_names: List[str], output_dir: str = "outputs", num_shards: int = DEFAULT_NUM_SHARDS, tabular_files: List[Path] = None, encoding: str = "flat", embedding_backend: str = None, chunks_dir: str = "outputs/chunks") -> None:
+    """Build vector database if it doesn't exist, measuring performance, then stream in tabular files.
 
-def build_vector_db(chunks: List[dict], output_dir: str = "outputs") -> None:
-    """Build vector database if it doesn't exist, measuring performance."""
+    The chunks of file_names are streamed from the chunk store and embedded in batches.
+    """
     vector_db_path = Path(output_dir) / "vector_db"
     if vector_db_path.exists():
         logger.info("Vector database already exists. Skipping creation.")
         return
     logger.info("Creating vector database...")
-    measure_performance(
-        "".join(chunk["text"] for chunk in chunks),
-        lambda _: create_vector_db(chunks),
-        "vectordb_creation"
-    )
+    chunk_store = ChunkStore(chunks_dir)
+    wanted = set(file_names)
+    stats = {"tokens": 0}
+
+    def stored_chunks():
+        for chunk in chunk_store.iter_chunks():
+            if chunk["file_name"] in wanted:
+                stats["tokens"] += count_tokens(chunk["text"])
+                yield chunk
+
+    start_time = time.time()
+    with profile_stage("vectordb_creation"):
+        create_vector_db(stored_chunks(), num_shards=num_shards, encoding=encoding, embedding_backend=embedding_backend)
+    elapsed = time.time() - start_time
+    chunk_store.close()
+    log_performance("vectordb_creation", stats["tokens"] / elapsed if elapsed > 0 else 0)
+    if tabular_files:
+        vector_store = ShardedVectorStore(vector_db_path)
+        for file_path in tabular_files:
+            logger.info(f"Streaming tabular file: {file_path}")
+            try:
+                stream_tabular_into_vector_db(file_path, vector_store)
+            except Exception as e:
+                logger.error(f"Error streaming {file_path}: {e}")
+        # Streamed batches land in the delta journals; fold them into the base indexes
+        vector_store.maybe_compact()
     logger.info("Vector database created.")
 
 
 
-def add_single_document(file_path: str, vector_db_path: str = "outputs/vector_db", chunks_dir: str = "outputs/chunks") -> None:
-    """Add a single document to the existing FAISS vector store."""
+def add_single_document(file_path: str, vector_db_path: str = "outputs/vector_db", chunks_dir: str = "outputs/chunks", embedding_backend: str = None) -> None:
+    """Add (or replace, if already indexed) a single document in the existing FAISS vector store.
+
+    Embeds with the backend recorded in the store unless embedding_backend is given (it must match).
+    """
     file_path = Path(file_path)
     if not file_path.is_file():
         logger.error(f"File {file_path} does not exist or is not a file.")
@@ -124,19 +211,30 @@ def add_single_document(file_path: str, vector_db_path: str = "outputs/vector_db
     logger.info(f"Adding single document: {file_path}")
     try:
         extension = file_path.suffix.lower()
+        if extension in TABULAR_EXTENSIONS:
+            # CSV/Excel: stream row groups straight into the store in constant memory
+            embeddings = get_embedding_backend(embedding_backend) if embedding_backend else None
+            vector_store = ShardedVectorStore(vector_db_path, embeddings)
+            stream_tabular_into_vector_db(file_path, vector_store)
+            # Nothing else to do meanwhile, so this path compacts synchronously
+            vector_store.maybe_compact()
+            return
+
         if extension == '.docx':
             # Handle .docx files with table extraction
             chunks = measure_performance(
                 str(file_path),
                 lambda _: process_file(str(file_path), chunks_dir),
-                f"extract_and_chunk_docx_{file_path.name}"
+                f"extract_and_chunk_docx_{file_path.name}",
+                stage="extract_and_chunk_docx"
             )
         else:
             # Handle other file types with text extraction
             text = measure_performance(
                 str(file_path),
                 lambda _: extract_text_from_file(str(file_path)),
-                f"extract_{file_path.name}"
+                f"extract_{file_path.name}",
+                stage="extract"
             )
             if not text or not text.strip():
                 logger.error(f"Empty or failed extraction: {file_path}")
@@ -144,9 +242,11 @@ def add_single_document(file_path: str, vector_db_path: str = "outputs/vector_db
             chunks = measure_performance(
                 text,
                 lambda t: chunk_text(t, str(file_path), max_tokens=1500, overlap_tokens=100),
-                f"chunk_{file_path.name}"
+                f"chunk_{file_path.name}",
+                stage="chunk"
             )
-            save_chunks(chunks, str(file_path), chunks_dir)
+            with profile_stage("save_chunks", str(file_path)):
+                save_chunks(chunks, str(file_path), chunks_dir)
 
         if not chunks:
             logger.error(f"No chunks created for {file_path}")
@@ -154,44 +254,162 @@ def add_single_document(file_path: str, vector_db_path: str = "outputs/vector_db
 
         logger.info(f"Extracted and chunked {len(chunks)} chunks from {file_path}")
 
-        # Load existing FAISS vector store
-        embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        vector_store = FAISS.load_local(vector_db_path, embeddings, allow_dangerous_deserialization=True)
+        # Open existing sharded vector store
+        embeddings = get_embedding_backend(embedding_backend) if embedding_backend else None
+        vector_store = ShardedVectorStore(vector_db_path, embeddings)
 
         # Convert chunks to LangChain Documents
-        documents = [
-            Document(
-                page_content=chunk["text"],
-                metadata={
-                    "file_name": chunk["file_name"],
-                    "page_number": chunk.get("page_number", 0),
-                    "chunk_number": chunk["chunk_number"],
-                    "section_type": chunk.get("section_type", "text")
-                }
-            ) for chunk in chunks
-        ]
-
-        # Add documents to vector store
+        documents = chunks_to_documents(chunks)
+
+        # Upsert: tombstone any previous version of this file, then add to its shard
         measure_performance(
             "".join(chunk["text"] for chunk in chunks),
-            lambda _: vector_store.add_documents(documents),
-            f"add_document_{file_path.name}"
+            lambda _: vector_store.upsert_documents(documents),
+            f"add_document_{file_path.name}",
+            stage="add_document"
         )
-
-        # Save updated vector store
-        vector_store.save_local(vector_db_path)
         logger.info(f"Added {len(chunks)} chunks from {file_path} to vector database.")
 
+        # Both stores compact at once: the vector store on its background thread
+        compaction = vector_store.compact_in_background()
+        compact_chunk_store(chunks_dir)
+        compaction.result()
+        vector_store.close()
+
     except Exception as e:
         logger.error(f"Error adding {file_path} to vector database: {e}")
 
 
 
-def run_rag_interactive(vector_db_path: str) -> None:
-    """Start an interactive RAG session."""
+def delete_document(file_name: str, vector_db_path: str = "outputs/vector_db", chunks_dir: str = "outputs/chunks") -> None:
+    """Remove all vectors and stored chunks of a previously indexed file."""
+    if not Path(vector_db_path).exists():
+        logger.error(f"Vector database {vector_db_path} does not exist.")
+        return
+    try:
+        vector_store = ShardedVectorStore(vector_db_path)
+        removed = vector_store.delete_file(Path(file_name).name)
+        # The vector store compacts on its background thread while the chunk store is updated
+        compaction = vector_store.compact_in_background() if removed else None
+        if Path(chunks_dir).exists():
+            chunk_store = ChunkStore(chunks_dir)
+            chunk_store.delete_file(Path(file_name).name)
+            chunk_store.close()
+            compact_chunk_store(chunks_dir)
+        if compaction is not None:
+            compaction.result()
+            vector_store.close()
+        if not removed:
+            logger.warning(f"No vectors found for {file_name}")
+            return
+        logger.info(f"Deleted {removed} chunks of {file_name} from vector database.")
+    except Exception as e:
+        logger.error(f"Error deleting {file_name} from vector database: {e}")
+
+
+
+def compact_vector_db(vector_db_path: str = "outputs/vector_db", threshold: float = 0.0) -> None:
+    """Rewrite shards, merging their delta journals and dropping tombstoned vectors."""
+    if not Path(vector_db_path).exists():
+        logger.error(f"Vector database {vector_db_path} does not exist.")
+        return
+    try:
+        vector_store = ShardedVectorStore(vector_db_path)
+        compacted = vector_store.maybe_compact(threshold)
+        logger.info(f"Compacted {len(compacted)} shards, dropped {sum(compacted.values())} tombstoned vectors.")
+    except Exception as e:
+        logger.error(f"Error compacting vector database: {e}")
+
+
+
+def run_rag_batch(vector_db_path: str, questions_path: str, output_path: str, max_concurrency: int = 4, filters: dict = None, embedding_backend: str = None) -> None:
+    """Answer a JSONL file of questions offline, streaming one JSON result per line to output_path."""
+    questions_file = Path(questions_path)
+    if not questions_file.is_file():
+        logger.error(f"Questions file {questions_file} does not exist or is not a file.")
+        return
+
+    def read_questions():
+        # Bad lines become error items (keyed by line number) that query_batch reports and skips
+        with open(questions_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield {"id": line_number, "error": f"Invalid JSON on line {line_number}: {e}"}
+                    continue
+                if isinstance(item, str):
+                    item = {"question": item}
+                if not isinstance(item, dict):
+                    yield {"id": line_number, "error": f"Line {line_number} is not a question string or object"}
+                    continue
+                item.setdefault("id", line_number)
+                yield item
+
+    start_time = time.time()
+    answered = failed = 0
+    try:
+        rag = RAGSystem(vector_db_path, embedding_backend=embedding_backend)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as out:
+            for result in rag.query_batch(read_questions(), filters=filters, max_concurrency=max_concurrency):
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                answered += 1
+                failed += "error" in result
+    except Exception as e:
+        logger.error(f"RAG batch failed: {e}")
+    elapsed = time.time() - start_time
+    logger.info(
+        f"Answered {answered} questions ({failed} failed) in {elapsed:.2f}s "
+        f"({answered / elapsed if elapsed > 0 else 0:.2f} questions/sec); results in {output_path}"
+    )
+
+
+
+def report_compression(vector_db_path: str = "outputs/vector_db", output_path: str = "outputs/compression_report.json", max_vectors: int = 100000) -> None:
+    """Report memory saved and recall@5 retained by each compressed encoding on the indexed corpus."""
+    if not Path(vector_db_path).exists():
+        logger.error(f"Vector database {vector_db_path} does not exist.")
+        return
+    try:
+        vectors = ShardedVectorStore(vector_db_path).full_precision_vectors(max_vectors=max_vectors)
+        if not len(vectors):
+            logger.error("Vector database is empty.")
+            return
+        report = compression_report(vectors)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+        for encoding, result in report["encodings"].items():
+            logger.info(
+                f"{encoding}: {result['memory_saved_pct']}% memory saved, "
+                f"recall@5={result['recall@5']}, rescored={result.get('recall@5_rescored')}"
+            )
+        logger.info(f"Saved compression report to {output_path}")
+    except Exception as e:
+        logger.error(f"Error building compression report: {e}")
+
+
+
+def run_rag_interactive(vector_db_path: str, max_loaded_shards: int = None, filters: dict = None, rescore_factor: int = DEFAULT_RESCORE_FACTOR, memory_tokens: int = DEFAULT_MEMORY_TOKENS, embedding_backend: str = None) -> None:
+    """Start an interactive RAG session.
+
+    Type '/filter field=value ...' (e.g. file_name=a.pdf,b.pdf section_type=table page_number=3-10,
+    quoting values with spaces: file_name="my report.pdf") to restrict retrieval, or '/filter'
+    alone to clear the filters. Page numbers are only recorded for PDFs.
+    """
     logger.info("Starting interactive RAG session. Type 'exit' to quit.")
     try:
-        rag = RAGSystem(vector_db_path)
+        rag = RAGSystem(
+            vector_db_path,
+            max_loaded_shards=max_loaded_shards,
+            rescore_factor=rescore_factor,
+            memory_tokens=memory_tokens,
+            embedding_backend=embedding_backend
+        )
+        filters = filters or {}
         while True:
             question = input("🧠 You: ")
             if question.strip().lower() in ["exit", "quit"]:
@@ -200,7 +418,14 @@ def run_rag_interactive(vector_db_path: str) -> None:
             if not question.strip():
                 logger.warning("Empty question. Please enter a valid question.")
                 continue
-            answer = measure_performance(question, rag.query, f"rag_{question[:20]}")
+            if question.strip().startswith("/filter"):
+                try:
+                    filters = parse_filters(shlex.split(question.strip())[1:])
+                    logger.info(f"Active filters: {filters or 'none'}")
+                except ValueError as e:
+                    logger.warning(str(e))
+                continue
+            answer = measure_performance(question, lambda q: rag.query(q, filters=filters), f"rag_{question[:20]}", stage="rag_query")
             print(f"\n🤖 Assistant: {answer}\n")
     except Exception as e:
         logger.error(f"RAG session failed: {e}")
@@ -218,7 +443,8 @@ def process_text(text: str, file_name: str, target_lang: str = None, summary_str
         translated = measure_performance(
             text,
             lambda t: translate_text(t, target_lang=target_lang),
-            f"translate_{file_name}"
+            f"translate_{file_name}",
+            stage="translate"
         )
         # logger.info(f"Translated (first 100 chars): {translated[:100]}...")
 
@@ -228,7 +454,8 @@ def process_text(text: str, file_name: str, target_lang: str = None, summary_str
         summary = measure_performance(
             text_to_summarize,
             lambda t: summarize_text(t, strategy=summary_strategy),
-            f"summarize_{file_name}"
+            f"summarize_{file_name}",
+            stage="summarize"
         )
         # logger.info(f"Summary (first 100 chars): {summary[:100]}...")
         # logger.info("Evaluating summary...")
@@ -246,6 +473,7 @@ def main(args: argparse.Namespace) -> None:
     start_time = time.time()
     logger.info("Starting NLP pipeline...")
     init_performance_log()  # Initialize performance.json
+    configure_models(max_concurrency=args.max_concurrency)
 
     # Ensure output directories exist
     Path("outputs/chunks").mkdir(parents=True, exist_ok=True)
@@ -254,7 +482,37 @@ def main(args: argparse.Namespace) -> None:
 
     # Handle adding a single document to the vector store
     if args.add_data:
-        add_single_document(args.add_data)
+        add_single_document(args.add_data, embedding_backend=args.embedding_backend)
+        logger.info(f"Pipeline completed in {time.time() - start_time:.2f} seconds.")
+        return
+
+    if args.rag_batch:
+        vector_db_path = Path("outputs") / "vector_db"
+        if not vector_db_path.exists():
+            logger.error("Vector database not found. Run pipeline with data_dir first.")
+            return
+        run_rag_batch(
+            str(vector_db_path),
+            args.rag_batch,
+            args.rag_batch_output,
+            max_concurrency=args.max_concurrency,
+            filters=parse_filters(args.filter),
+            embedding_backend=args.embedding_backend
+        )
+        logger.info(f"Pipeline completed in {time.time() - start_time:.2f} seconds.")
+        return
+
+    if args.compression_report:
+        report_compression()
+        logger.info(f"Pipeline completed in {time.time() - start_time:.2f} seconds.")
+        return
+
+    # Handle deleting a document from / compacting the vector store
+    if args.delete_data or args.compact:
+        if args.delete_data:
+            delete_document(args.delete_data)
+        if args.compact:
+            compact_vector_db()
         logger.info(f"Pipeline completed in {time.time() - start_time:.2f} seconds.")
         return
 
@@ -293,19 +551,32 @@ def main(args: argparse.Namespace) -> None:
         vector_db_path = Path("outputs") / "vector_db"
         if args.data_dir:
             # Handle full pipeline (data_dir and RAG)
-            all_chunks = extract_and_chunk(args.data_dir)
-            if not all_chunks:
+            chunked_files = extract_and_chunk(args.data_dir)
+            tabular_files = find_tabular_files(args.data_dir)
+            if not chunked_files and not tabular_files:
                 logger.error("No chunks created, check the path. Aborting pipeline.")
                 return
 
-            if all_chunks:
-                build_vector_db(all_chunks)
+            build_vector_db(
+                chunked_files,
+                num_shards=args.num_shards,
+                tabular_files=tabular_files,
+                encoding=args.vector_encoding,
+                embedding_backend=args.embedding_backend
+            )
 
         if not vector_db_path.exists():
             logger.error("Vector database not found. Run pipeline with data_dir first.")
             return
         
-        run_rag_interactive(str(vector_db_path))
+        run_rag_interactive(
+            str(vector_db_path),
+            max_loaded_shards=args.max_loaded_shards,
+            filters=parse_filters(args.filter),
+            rescore_factor=args.rescore_factor,
+            memory_tokens=args.memory_tokens,
+            embedding_backend=args.embedding_backend
+        )
 
     logger.info(f"Pipeline completed in {time.time() - start_time:.2f} seconds.")
 
@@ -316,11 +587,39 @@ if __name__ == "__main__":
     parser.add_argument("--data-dir", help="Directory containing input files")
     parser.add_argument("--input-file", help="Single text file to translate or summarize")
     parser.add_argument("--add-data", help="Single file to add to the vector database")
+    parser.add_argument("--delete-data", help="File name to remove from the vector database")
+    parser.add_argument("--compact", action="store_true", help="Compact the vector database, dropping deleted vectors")
     parser.add_argument("--rag", action="store_true", help="Start interactive RAG session")
+    parser.add_argument("--memory-tokens", type=int, default=DEFAULT_MEMORY_TOKENS, help="Token budget for RAG conversation memory")
+    parser.add_argument("--rag-batch", help="JSONL file of questions ({\"id\": ..., \"question\": ...}) to answer offline")
+    parser.add_argument("--rag-batch-output", default="outputs/rag_batch_answers.jsonl", help="Output JSONL for --rag-batch")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Max concurrent model requests, shared by all stages (and --rag-batch generations)")
     parser.add_argument("--translate", action="store_true", help="Translate text")
     parser.add_argument("--summarize", action="store_true", help="Summarize text")
     parser.add_argument("--target-lang", default="en", choices=["en", "ar"], help="Target language for translation")
     parser.add_argument("--summary-strategy", default="abstractive", choices=["abstractive", "extractive"], help="Summarization strategy")
     parser.add_argument("--max-chars", type=int, help="Max characters for translation/summarization")
+    parser.add_argument("--filter", action="append", help="Restrict RAG retrieval, e.g. file_name=a.pdf,b.pdf, section_type=table or page_number=3-10 (PDFs only; repeatable)")
+    parser.add_argument("--num-shards", type=int, default=DEFAULT_NUM_SHARDS, help="Number of vector store shards to build")
+    parser.add_argument("--vector-encoding", default="flat", choices=VECTOR_ENCODINGS, help="How vectors are stored in new indexes")
+    parser.add_argument("--embedding-backend", help="Embeddings for new indexes: ollama[/<model>] (default ollama/nomic-embed-text) or in-process hashing[/<dim>]; existing indexes use the backend they were built with")
+    parser.add_argument("--rescore-factor", type=int, default=DEFAULT_RESCORE_FACTOR, help="Candidates per result rescored exactly on compressed indexes (0 disables)")
+    parser.add_argument("--compression-report", action="store_true", help="Report memory saved and recall@5 per vector encoding")
+    parser.add_argument("--max-loaded-shards", type=int, help="Max shards kept in memory during RAG (least used are evicted)")
+    parser.add_argument("--profile", action="store_true", help=f"Profile CPU and memory per pipeline stage into {PROFILE_DIR}/")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    if args.profile:
+        enable_profiling()
+    try:
+        main(args)
+    finally:
+        profile_summary = finish_profiling()
+        if profile_summary is not None:
+            for stage in sorted(profile_summary, key=lambda s: s["wall_seconds"], reverse=True):
+                logger.info(
+                    f"Profile {stage['stage']}: {stage['wall_seconds']}s wall, {stage['cpu_seconds']}s CPU, "
+                    f"peak RSS {stage['rss_peak_mb']} MB, traced peak {stage['traced_peak_mb']} MB"
+                )
+            logger.info(f"Saved profiles to {PROFILE_DIR}/ (*.collapsed for flamegraphs, *.prof for pstats)")
+    for model, stats in model_stats().items():
+        logger.info(f"Model {model}: {stats}")
\ No newline at end of file
@@ -0,0 +1,152 @@
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+try:
+    from src.model_registry import show_model
+except ImportError:
+    from model_registry import show_model
+
+DEFAULT_CONTEXT_TOKENS = 4096
+# Cap the num_ctx we request so long-context models do not exhaust the server's memory
+MAX_CONTEXT_TOKENS = 8192
+KNOWN_CONTEXT_TOKENS = {"llama3": 8192, "llama2": 4096, "mistral": 8192}
+# The cost model has four coefficients, and needs calls of at least three distinct sizes
+MIN_TUNING_SAMPLES = 4
+MIN_DISTINCT_SIZES = 3
+
+_context_cache = {}
+_sizers = {}
+_lock = threading.Lock()
+
+
+def resolve_context_tokens(model, max_context_tokens=MAX_CONTEXT_TOKENS):
+    """Context window for a model: Ollama's reported context_length, else a known default."""
+    with _lock:
+        if model in _context_cache:
+            return _context_cache[model]
+    context_tokens = None
+    try:
+        model_info = show_model(model).modelinfo or {}
+        for key, value in model_info.items():
+            if key.endswith(".context_length"):
+                context_tokens = int(value)
+                break
+    except Exception:
+        pass
+    if context_tokens is None:
+        context_tokens = KNOWN_CONTEXT_TOKENS.get(model.split(":")[0], DEFAULT_CONTEXT_TOKENS)
+    context_tokens = min(context_tokens, max_context_tokens)
+    with _lock:
+        _context_cache[model] = context_tokens
+    return context_tokens
+
+
+class ChunkSizer:
+    """Chooses chunk sizes in real tokens for one LLM task (e.g. abstractive summaries).
+
+    The upper bound comes from the context window: prompt overhead + chunk + expected
+    output (chunk * output_ratio) must fit in context_tokens * safety_margin. With
+    auto_tune, observed calls are fitted to seconds = a + b*in + c*out + d*in^2 and the
+    chunk size minimising estimated wall time per document is used instead. A document
+    costs a per call plus its tokens and the overlap repeated in every call, so without
+    a superlinear term that is simply the largest chunk (fewest calls). max_call_seconds
+    caps the estimated time of a single call; if even min_chunk_tokens exceeds it, that
+    smallest size is used.
+    """
+
+    def __init__(self, model, prompt_overhead_tokens, output_ratio, overlap_tokens=0,
+                 context_tokens=None, safety_margin=0.9, min_chunk_tokens=256,
+                 auto_tune=True, max_call_seconds=None, max_samples=50):
+        self.model = model
+        self.prompt_overhead_tokens = prompt_overhead_tokens
+        self.output_ratio = output_ratio
+        self.overlap_tokens = overlap_tokens
+        self._context_tokens = context_tokens
+        self.safety_margin = safety_margin
+        self.min_chunk_tokens = min_chunk_tokens
+        self.auto_tune = auto_tune
+        self.max_call_seconds = max_call_seconds
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    @property
+    def context_tokens(self):
+        if self._context_tokens is None:
+            self._context_tokens = resolve_context_tokens(self.model)
+        return self._context_tokens
+
+    def max_chunk_tokens(self):
+        """Largest chunk whose prompt and expected output still fit in the context window."""
+        budget = int(self.context_tokens * self.safety_margin) - self.prompt_overhead_tokens
+        return max(self.min_chunk_tokens, int(budget / (1 + self.output_ratio)))
+
+    def record(self, input_tokens, output_tokens, seconds):
+        """Record one LLM call for auto-tuning."""
+        with self._lock:
+            self._samples.append((input_tokens, output_tokens, seconds))
+
+    @property
+    def tokens_per_second(self):
+        """Observed output tokens per second over the recorded calls."""
+        with self._lock:
+            seconds = sum(s for _, _, s in self._samples)
+            return sum(o for _, o, _ in self._samples) / seconds if seconds else 0.0
+
+    def _fit(self):
+        with self._lock:
+            if len(self._samples) < MIN_TUNING_SAMPLES:
+                return None
+            samples = np.array(self._samples, dtype=np.float64)
+        inputs = samples[:, 0]
+        # Calls of too few or too similar sizes cannot separate per-call, linear and quadratic cost
+        if len(np.unique(inputs)) < MIN_DISTINCT_SIZES or inputs.max() < 1.2 * max(inputs.min(), 1):
+            return None
+        features = np.column_stack([np.ones(len(samples)), inputs, samples[:, 1], inputs ** 2])
+        coefficients, *_ = np.linalg.lstsq(features, samples[:, 2], rcond=None)
+        return np.clip(coefficients, 0, None)
+
+    def chunk_tokens(self, document_tokens=None):
+        """Chunk size (tokens) to use for a document of document_tokens tokens."""
+        upper = self.max_chunk_tokens()
+        if not self.auto_tune:
+            return upper
+        coefficients = self._fit()
+        if coefficients is None:
+            return upper
+        per_call, per_input, per_output, per_input_squared = coefficients
+        document_tokens = document_tokens or 10 * upper
+        # Only reached as the result when even the smallest size exceeds max_call_seconds
+        best_size, best_seconds = self.min_chunk_tokens, math.inf
+        step = max(32, (upper - self.min_chunk_tokens) // 32)
+        for size in [*range(self.min_chunk_tokens, upper, step), upper]:
+            call_seconds = (
+                per_call
+                + per_input * size
+                + per_output * size * self.output_ratio
+                + per_input_squared * size ** 2
+            )
+            if self.max_call_seconds and call_seconds > self.max_call_seconds:
+                break
+            calls = math.ceil(max(document_tokens - self.overlap_tokens, 1) / max(size - self.overlap_tokens, 1))
+            # Tokens actually sent: the document once plus the overlap repeated per call,
+            # spread over calls chunks of (on average) input_tokens / calls tokens
+            input_tokens = document_tokens + calls * self.overlap_tokens
+            seconds = (
+                calls * per_call
+                + (per_input + per_output * self.output_ratio) * input_tokens
+                + per_input_squared * input_tokens ** 2 / calls
+            )
+            if seconds <= best_seconds:
+                best_size, best_seconds = size, seconds
+        return best_size
+
+
+def get_sizer(name, **kwargs):
+    """Return the process-wide sizer for a task name, so tuning carries across documents."""
+    with _lock:
+        if name not in _sizers:
+            _sizers[name] = ChunkSizer(**kwargs)
+        return _sizers[name]
@@ -0,0 +1,295 @@
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+TEXT_FILE = "text.bin"
+DICTIONARIES_FILE = "dictionaries.json"
+# Fixed-width little-endian columns, one row per chunk. offsets holds the end of each
+# chunk's text in text.bin and is written last, so its length is the committed row count.
+COLUMNS = {
+    "file_id": "<u4",
+    "chunk_number": "<u4",
+    "page_number": "<u4",
+    "section_id": "<u2",
+    "deleted": "u1",
+    "offsets": "<u8"
+}
+DICTIONARY_FIELDS = {"file_id": "file_name", "section_id": "section_type"}
+# Rows whose columns are read in one go while iterating
+ITER_BLOCK_ROWS = 4096
+# Share of deleted rows at which maybe_compact rewrites the store
+DEFAULT_COMPACTION_THRESHOLD = 0.2
+
+
+class ChunkStore:
+    """Append-only columnar chunk store: one UTF-8 text blob, an offsets array and
+    fixed-width metadata columns, memory-mapped for random access by chunk id.
+
+    File names and section types are dictionary-encoded. Re-adding a file marks its
+    previous chunks deleted instead of rewriting anything; compact() drops them. Rows
+    from an interrupted append (columns longer than offsets) are discarded on open.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        staged = self._sibling("compact")
+        if not self.path.exists() and staged.exists():
+            # Compaction was interrupted after moving the old store aside
+            os.replace(staged, self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        dictionaries = {}
+        if (self.path / DICTIONARIES_FILE).exists():
+            with open(self.path / DICTIONARIES_FILE, "r", encoding="utf-8") as f:
+                dictionaries = json.load(f)
+        self._values = {field: dictionaries.get(field, []) for field in DICTIONARY_FIELDS.values()}
+        self._ids = {field: {value: i for i, value in enumerate(values)} for field, values in self._values.items()}
+        self._columns = {}
+        self._text = None
+        self._text_file = None
+        self._count = self._column_length("offsets")
+        self._truncate()
+
+    def _sibling(self, suffix):
+        return self.path.with_name(f"{self.path.name}.{suffix}")
+
+    def _column_path(self, name):
+        return self.path / f"{name}.bin"
+
+    def _column_length(self, name):
+        path = self._column_path(name)
+        return path.stat().st_size // np.dtype(COLUMNS[name]).itemsize if path.exists() else 0
+
+    def _truncate(self):
+        for name, dtype in COLUMNS.items():
+            path = self._column_path(name)
+            if path.exists() and self._column_length(name) > self._count:
+                os.truncate(path, self._count * np.dtype(dtype).itemsize)
+        text_path = self.path / TEXT_FILE
+        text_size = int(self.column("offsets")[-1]) if self._count else 0
+        if text_path.exists() and text_path.stat().st_size > text_size:
+            os.truncate(text_path, text_size)
+        self._columns = {}
+
+    def __len__(self):
+        return self._count
+
+    def column(self, name):
+        """Memory-mapped metadata column (an empty array when the store is empty)."""
+        if self._count == 0:
+            return np.empty(0, dtype=COLUMNS[name])
+        if name not in self._columns:
+            self._columns[name] = np.memmap(
+                self._column_path(name),
+                dtype=COLUMNS[name],
+                mode="r+" if name == "deleted" else "r",
+                shape=(self._count,)
+            )
+        return self._columns[name]
+
+    def _text_buffer(self):
+        if self._text is None:
+            self._text_file = open(self.path / TEXT_FILE, "rb")
+            self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._text
+
+    def _encode(self, field, value):
+        ids = self._ids[field]
+        if value not in ids:
+            ids[value] = len(self._values[field])
+            self._values[field].append(value)
+        return ids[value]
+
+    def append(self, chunks, replace=True):
+        """Append chunks and return their ids. With replace, earlier chunks of the same
+        files are marked deleted first, so re-processing a file does not duplicate it."""
+        chunks = list(chunks)
+        if not chunks:
+            return range(self._count, self._count)
+        replaced = []
+        if replace:
+            replaced = [self.ids_for_file(file_name) for file_name in {chunk["file_name"] for chunk in chunks}]
+
+        texts = [chunk["text"].encode("utf-8") for chunk in chunks]
+        start = int(self.column("offsets")[-1]) if self._count else 0
+        rows = {
+            "file_id": [self._encode("file_name", chunk["file_name"]) for chunk in chunks],
+            "chunk_number": [chunk.get("chunk_number") or 0 for chunk in chunks],
+            "page_number": [chunk.get("page_number") or 0 for chunk in chunks],
+            "section_id": [self._encode("section_type", chunk.get("section_type", "text")) for chunk in chunks],
+            "deleted": [0] * len(chunks),
+            "offsets": start + np.cumsum([len(text) for text in texts], dtype=np.uint64)
+        }
+
+        self.close()
+        with open(self.path / TEXT_FILE, "ab") as f:
+            f.write(b"".join(texts))
+        tmp_path = self.path / (DICTIONARIES_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._values, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path / DICTIONARIES_FILE)
+        # offsets last: the rows only become visible once it is written
+        for name, dtype in COLUMNS.items():
+            with open(self._column_path(name), "ab") as f:
+                f.write(np.asarray(rows[name], dtype=dtype).tobytes())
+
+        first = self._count
+        self._count += len(chunks)
+        # Retire the old versions only once the new ones are committed
+        if replaced:
+            deleted = self.column("deleted")
+            for ids in replaced:
+                deleted[ids] = 1
+            deleted.flush()
+        return range(first, self._count)
+
+    def ids_for_file(self, file_name):
+        """Ids of the live chunks of a file."""
+        file_id = self._ids["file_name"].get(file_name)
+        if file_id is None or self._count == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero((self.column("file_id") == file_id) & (self.column("deleted") == 0))
+
+    def delete_file(self, file_name):
+        """Mark a file's chunks deleted in place; returns how many were live."""
+        ids = self.ids_for_file(file_name)
+        if len(ids):
+            deleted = self.column("deleted")
+            deleted[ids] = 1
+            deleted.flush()
+        return len(ids)
+
+    def text_view(self, chunk_id):
+        """Zero-copy memoryview of a chunk's UTF-8 text; it keeps its mapping alive while referenced."""
+        offsets = self.column("offsets")
+        start = int(offsets[chunk_id - 1]) if chunk_id else 0
+        end = int(offsets[chunk_id])
+        if start == end:
+            # mmap cannot map an empty text.bin
+            return memoryview(b"")
+        return memoryview(self._text_buffer())[start:end]
+
+    def __getitem__(self, chunk_id):
+        if not 0 <= chunk_id < self._count:
+            raise IndexError(f"Chunk id {chunk_id} out of range for {self._count} chunks")
+        return {
+            "file_name": self._values["file_name"][self.column("file_id")[chunk_id]],
+            "chunk_number": int(self.column("chunk_number")[chunk_id]),
+            "page_number": int(self.column("page_number")[chunk_id]),
+            "section_type": self._values["section_type"][self.column("section_id")[chunk_id]],
+            "text": str(self.text_view(chunk_id), "utf-8")
+        }
+
+    def _iter_rows(self, include_deleted=False):
+        """Yield (chunk_id, columns block, row in block, text memoryview), reading columns in blocks."""
+        if self._count == 0:
+            return
+        text = memoryview(self._text_buffer()) if int(self.column("offsets")[-1]) else memoryview(b"")
+        start = 0
+        for first in range(0, self._count, ITER_BLOCK_ROWS):
+            block = {name: self.column(name)[first:first + ITER_BLOCK_ROWS].tolist() for name in COLUMNS}
+            for row, end in enumerate(block["offsets"]):
+                if include_deleted or not block["deleted"][row]:
+                    yield first + row, block, row, text[start:end]
+                start = end
+
+    def iter_chunks(self, include_deleted=False):
+        """Yield live chunks as dicts in id order, decoding text straight from the mmap."""
+        file_names, section_types = self._values["file_name"], self._values["section_type"]
+        for _, block, row, text in self._iter_rows(include_deleted):
+            yield {
+                "file_name": file_names[block["file_id"][row]],
+                "chunk_number": block["chunk_number"][row],
+                "page_number": block["page_number"][row],
+                "section_type": section_types[block["section_id"][row]],
+                "text": str(text, "utf-8")
+            }
+
+    def iter_texts(self):
+        """Yield (chunk_id, memoryview) for live chunks without copying any text.
+
+        Rows appended while iterating are not visited; the views stay valid after an
+        append or close, as each keeps the mapping it came from alive.
+        """
+        for chunk_id, _, _, text in self._iter_rows():
+            yield chunk_id, text
+
+    def export_json(self, output_path, file_name=None):
+        """Write live chunks (optionally of one file) as pretty-printed JSON, for debugging."""
+        if file_name is None:
+            chunks = list(self.iter_chunks())
+        else:
+            chunks = [self[int(chunk_id)] for chunk_id in self.ids_for_file(file_name)]
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(chunks, f, indent=4, ensure_ascii=False)
+        return len(chunks)
+
+    def compact(self):
+        """Rewrite the store with only its live rows; returns the number of rows dropped.
+
+        Live chunks are renumbered in order. The new store is written to a sibling
+        directory and swapped in, so an interrupted compaction leaves a complete store.
+        """
+        live = np.flatnonzero(self.column("deleted") == 0)
+        dropped = self._count - len(live)
+        if not dropped:
+            return 0
+        target = self._sibling("compact")
+        shutil.rmtree(target, ignore_errors=True)
+        target.mkdir()
+
+        ends = self.column("offsets").astype(np.int64)
+        starts = np.concatenate(([0], ends[:-1]))
+        text = self._text_buffer() if len(live) and ends[-1] else b""
+        with open(target / TEXT_FILE, "wb") as f:
+            for first in range(0, len(live), ITER_BLOCK_ROWS):
+                f.write(b"".join(text[starts[i]:ends[i]] for i in live[first:first + ITER_BLOCK_ROWS]))
+        with open(target / DICTIONARIES_FILE, "w", encoding="utf-8") as f:
+            json.dump(self._values, f, ensure_ascii=False)
+        rows = {name: self.column(name)[live] for name in ("file_id", "chunk_number", "page_number", "section_id")}
+        rows["deleted"] = np.zeros(len(live))
+        rows["offsets"] = np.cumsum(ends[live] - starts[live])
+        for name, dtype in COLUMNS.items():
+            with open(target / f"{name}.bin", "wb") as f:
+                f.write(np.asarray(rows[name], dtype=dtype).tobytes())
+
+        self.close()
+        retired = self._sibling("old")
+        shutil.rmtree(retired, ignore_errors=True)
+        os.replace(self.path, retired)
+        os.replace(target, self.path)
+        shutil.rmtree(retired, ignore_errors=True)
+        self._count = len(live)
+        return dropped
+
+    def maybe_compact(self, threshold=DEFAULT_COMPACTION_THRESHOLD):
+        """Compact once deleted rows make up at least threshold of the store; returns rows dropped."""
+        deleted = int(np.count_nonzero(self.column("deleted")))
+        if deleted and deleted / self._count >= threshold:
+            return self.compact()
+        return 0
+
+    def close(self):
+        """Release the memory maps; the store reopens them lazily on next access.
+
+        A text mapping still referenced by views or an unfinished iterator cannot be
+        closed (BufferError); it is dropped instead and unmapped once those are released.
+        """
+        self._columns = {}
+        if self._text is not None:
+            try:
+                self._text.close()
+            except BufferError:
+                pass
+            self._text_file.close()
+            self._text, self._text_file = None, None
+
+
+if __name__ == "__main__":
+    base_dir = Path(__file__).parent.parent
+    store = ChunkStore(base_dir / "outputs" / "chunks")
+    output_path = base_dir / "outputs" / "chunks_export.json"
+    print(f"Exported {store.export_json(output_path)} chunks to {output_path}")
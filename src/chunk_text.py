@@ -1,12 +1,26 @@
-import json
 import os
+import re
+from bisect import bisect_right
 from pathlib import Path
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+try:
+    from src.chunk_store import ChunkStore
+except ImportError:
+    from chunk_store import ChunkStore
+
+# Page markers extract_text_from_file writes for PDFs: "Page 3: ..." and "[Figure Caption - Page 3]: ..."
+PAGE_MARKER = re.compile(r"^(?:Page (\d+): |\[Figure Caption - Page (\d+)\]: )", re.MULTILINE)
+
 def chunk_text(text, file_name, max_tokens=1000, overlap_tokens=100):
-    """Chunk text using LangChain's RecursiveCharacterTextSplitter."""
+    """Chunk text using LangChain's RecursiveCharacterTextSplitter.
+
+    Text with PDF page markers gets a page_number per chunk: the page the chunk starts on.
+    """
     if not text.strip():
         return []
+    markers = [(match.start(), int(match.group(1) or match.group(2))) for match in PAGE_MARKER.finditer(text)]
+    marker_offsets = [offset for offset, _ in markers]
 
     # Initialize text splitter
     text_splitter = RecursiveCharacterTextSplitter(
@@ -26,27 +40,30 @@ def chunk_text(text, file_name, max_tokens=1000, overlap_tokens=100):
     for doc in documents:
 
         # Create chunk metadata
-        chunks.append({
+        chunk = {
             "file_name": os.path.basename(file_name),
             "chunk_number": chunk_num,
             "text": doc.page_content.strip()
-        })
+        }
+        marker = bisect_right(marker_offsets, doc.metadata.get("start_index", -1)) - 1
+        if marker >= 0:
+            chunk["page_number"] = markers[marker][1]
+        chunks.append(chunk)
         chunk_num += 1
 
     return chunks
 
 def save_chunks(chunks, file_name, chunks_dir):
-    """Save chunks to JSON file."""
+    """Append chunks to the binary chunk store in chunks_dir, replacing earlier chunks of the file."""
     if not chunks:
         return
-    os.makedirs(chunks_dir, exist_ok=True)
-    output_filename = os.path.splitext(os.path.basename(file_name))[0] + ".json"
-    output_path = os.path.join(chunks_dir, output_filename)
+    store = ChunkStore(chunks_dir)
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, indent=4, ensure_ascii=False)
+        store.append(chunks)
     except Exception as e:
-        print(f"Error saving {output_path}: {e}")
+        print(f"Error saving chunks of {file_name} to {chunks_dir}: {e}")
+    finally:
+        store.close()
 
 if __name__ == "__main__":
     base_dir = Path(__file__).parent.parent
@@ -0,0 +1,115 @@
+from collections import deque
+
+try:
+    from src.utils import count_tokens, truncate_tokens
+except ImportError:
+    from utils import count_tokens, truncate_tokens
+
+DEFAULT_MEMORY_TOKENS = 1500
+DEFAULT_RECENT_TURNS = 4
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and an assistant.
+strictly give the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New exchanges to fold in:
+{turns}
+
+Updated summary:"""
+
+REWRITE_PROMPT = """Rewrite the user's follow-up question as a standalone question that can be understood
+without the conversation. Resolve references such as "it", "they" or "the second one".
+If it is already standalone, return it unchanged. strictly give the question only.
+
+Conversation:
+{history}
+
+Follow-up question: {question}
+Standalone question:"""
+
+def _format_turns(turns):
+    return "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+class ConversationMemory:
+    """Token-budgeted chat memory: recent turns verbatim plus a rolling summary of older ones.
+
+    When the verbatim turns exceed their share of the budget, the oldest turns are folded
+    into the summary with one LLM call over (summary + evicted turns) only, so the cost per
+    turn does not grow with the length of the session. Eviction goes down to half the
+    budget, so that call is made every few turns rather than on every turn once full.
+    """
+
+    def __init__(self, llm, max_tokens=DEFAULT_MEMORY_TOKENS, max_recent_turns=DEFAULT_RECENT_TURNS):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.max_recent_turns = max_recent_turns
+        # A third of the budget for the summary, the rest for verbatim turns
+        self.summary_tokens = max_tokens // 3
+        self.turn_tokens = max_tokens - self.summary_tokens
+        self.summary = ""
+        self.turns = deque()
+        self._turn_sizes = deque()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def add_turn(self, question, answer):
+        """Record one exchange, compressing the oldest turns if the budget is exceeded."""
+        # A single oversized exchange must still fit in the verbatim budget
+        question = truncate_tokens(question, self.turn_tokens // 4)
+        answer = truncate_tokens(answer, self.turn_tokens // 2)
+        self.turns.append((question, answer))
+        self._turn_sizes.append(count_tokens(question) + count_tokens(answer))
+
+        if len(self.turns) <= self.max_recent_turns and sum(self._turn_sizes) <= self.turn_tokens:
+            return
+        evicted = []
+        # The newest turn always stays verbatim
+        while len(self.turns) > 1 and (
+            len(self.turns) > self.max_recent_turns // 2 or sum(self._turn_sizes) > self.turn_tokens // 2
+        ):
+            evicted.append(self.turns.popleft())
+            self._turn_sizes.popleft()
+        if evicted:
+            self._fold_into_summary(evicted)
+
+    def _fold_into_summary(self, turns):
+        prompt = SUMMARY_PROMPT.format(
+            max_words=int(self.summary_tokens * 0.75),
+            summary=self.summary or "(empty)",
+            turns=_format_turns(turns)
+        )
+        try:
+            summary = self.llm.invoke(prompt).strip()
+        except Exception:
+            # Keep the conversation going; fall back to appending the raw turns
+            summary = f"{self.summary}\n{_format_turns(turns)}".strip()
+        self.summary = truncate_tokens(summary, self.summary_tokens)
+
+    def condensed_history(self):
+        """Summary plus verbatim recent turns, for use in prompts."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation: {self.summary}")
+        if self.turns:
+            parts.append(_format_turns(self.turns))
+        return "\n".join(parts)
+
+    def rewrite_query(self, question):
+        """Turn a follow-up into a standalone retrieval query using the condensed history."""
+        history = self.condensed_history()
+        if not history:
+            return question
+        try:
+            rewritten = self.llm.invoke(REWRITE_PROMPT.format(history=history, question=question)).strip()
+        except Exception:
+            return question
+        return rewritten.strip('"') or question
+
+    def clear(self):
+        self.summary = ""
+        self.turns.clear()
+        self._turn_sizes.clear()
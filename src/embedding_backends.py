@@ -0,0 +1,74 @@
+import re
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    from src.model_registry import get_embeddings
+except ImportError:
+    from model_registry import get_embeddings
+
+EMBEDDING_BACKENDS = ("ollama", "hashing")
+DEFAULT_EMBEDDING_BACKEND = "ollama/nomic-embed-text"
+DEFAULT_HASHING_DIM = 1024
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _feature_hash(feature):
+    # crc32 rather than hash(): it must be stable across processes for stored vectors to match queries.
+    # Not cached: crc32 of a short string costs about as much as the cache lookup would.
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbeddings(Embeddings):
+    """In-process CPU embeddings: signed feature hashing of word unigrams and bigrams.
+
+    Needs no model server and embeds at tokenizer speed. Vectors are lexical rather than
+    semantic (sublinear term counts, L2-normalised), so retrieval quality is closer to
+    keyword search than to a neural model.
+    """
+
+    def __init__(self, dim=DEFAULT_HASHING_DIM):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+        self.identity = f"hashing/{dim}"
+
+    def _embed(self, text):
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not features:
+            return vector
+        hashes = np.fromiter((_feature_hash(f) for f in features), dtype=np.uint32, count=len(features))
+        # The top bit picks the sign so colliding features tend to cancel instead of pile up
+        signs = np.where(hashes >> 31, -1.0, 1.0)
+        vector += np.bincount(hashes % self.dim, weights=signs, minlength=self.dim)
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts):
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text).tolist()
+
+
+def get_embedding_backend(spec=DEFAULT_EMBEDDING_BACKEND):
+    """Return embeddings for a backend spec: 'ollama[/<model>]' or 'hashing[/<dim>]'.
+
+    A backend's identity is its full spec, so get_embedding_backend(embedding_identity(e))
+    recreates an equivalent backend.
+    """
+    name, _, option = spec.partition("/")
+    if name == "ollama":
+        return get_embeddings(option or DEFAULT_EMBEDDING_BACKEND.partition("/")[2])
+    if name == "hashing":
+        return HashingEmbeddings(int(option) if option else DEFAULT_HASHING_DIM)
+    raise ValueError(f"Unknown embedding backend '{spec}'; expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def embedding_identity(embeddings):
+    """Identity recorded in index manifests, or None for embeddings outside these backends."""
+    return getattr(embeddings, "identity", None)
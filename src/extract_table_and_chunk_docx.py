@@ -1,8 +1,12 @@
 import os
-import json
 from pathlib import Path
 from docx import Document
 
+try:
+    from src.chunk_store import ChunkStore
+except ImportError:
+    from chunk_store import ChunkStore
+
 def extract_and_chunk_tables_from_docx(file_path, rows_per_chunk=5, max_tokens=1000, overlap_tokens=100):
     """Extract and chunk tables from a .docx document, splitting by rows."""
     if not file_path.endswith('.docx'):
@@ -42,6 +46,8 @@ def extract_and_chunk_tables_from_docx(file_path, rows_per_chunk=5, max_tokens=1
                     "table_id": f"Table {table_idx}",
                     "header": header,
                     "rows": chunk_rows,
+                    # Flattened form stored in the chunk store and embedded
+                    "text": "\n".join([f"Table {table_idx}", " | ".join(header)] + [" | ".join(row) for row in chunk_rows]),
                     "section_type": "table"
                 })
                 chunk_num += 1
@@ -53,19 +59,21 @@ def extract_and_chunk_tables_from_docx(file_path, rows_per_chunk=5, max_tokens=1
         return []
 
 def process_file(file_path, chunks_dir):
-    """Process a file: extract tables if .docx, otherwise chunk text."""
-    os.makedirs(chunks_dir, exist_ok=True)
+    """Process a file: extract table chunks if .docx and append them to the chunk store."""
     extension = os.path.splitext(file_path)[1].lower()
+    chunks = []
     
     if extension == '.docx':
         chunks = extract_and_chunk_tables_from_docx(file_path)
 
     if chunks:
-        output_filename = os.path.splitext(os.path.basename(file_path))[0] + "_tables" + ".json"
-        output_path = os.path.join(chunks_dir, output_filename)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, indent=4, ensure_ascii=False)
+        store = ChunkStore(chunks_dir)
+        try:
+            store.append(chunks)
+        finally:
+            store.close()
         print(f"Chunked into {len(chunks)} pieces: {file_path}")
+    return chunks
 
 if __name__ == "__main__":
     base_dir = Path(__file__).parent.parent
@@ -0,0 +1,112 @@
+import csv
+import os
+import time
+
+TABULAR_EXTENSIONS = ('.csv', '.xlsx', '.xlsm')
+DEFAULT_MAX_CHARS = 1500
+PANDAS_CHUNK_ROWS = 10000
+
+
+def _format_row(values):
+    return " | ".join("" if value is None else str(value).strip().replace('\n', ' ') for value in values)
+
+
+def _iter_csv_rows(file_path):
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        yield None, header, reader
+
+
+def _iter_csv_rows_pandas(file_path):
+    import pandas as pd
+
+    reader = pd.read_csv(file_path, chunksize=PANDAS_CHUNK_ROWS, dtype=str, keep_default_na=False)
+    first = next(reader, None)
+    if first is None:
+        return
+
+    def rows():
+        yield from first.itertuples(index=False, name=None)
+        for frame in reader:
+            yield from frame.itertuples(index=False, name=None)
+
+    yield None, list(first.columns), rows()
+
+
+def _iter_excel_rows(file_path):
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the sheet XML instead of building the whole workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            yield sheet.title, header, rows
+    finally:
+        workbook.close()
+
+
+def stream_tabular_chunks(file_path, max_chars=DEFAULT_MAX_CHARS, stats=None, use_pandas=False):
+    """Yield row-group chunks of a CSV/Excel file with the header repeated, in constant memory.
+
+    Rows are grouped until a chunk reaches max_chars. If a stats dict is given it is
+    updated with rows, chunks, seconds and rows_per_second as the stream is consumed.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        tables = _iter_csv_rows_pandas(file_path) if use_pandas else _iter_csv_rows(file_path)
+    elif extension in ('.xlsx', '.xlsm'):
+        tables = _iter_excel_rows(file_path)
+    else:
+        raise ValueError(f"Unsupported tabular format: {extension}")
+
+    stats = stats if stats is not None else {}
+    stats.update({"rows": 0, "chunks": 0, "seconds": 0.0, "rows_per_second": 0.0})
+    start_time = time.time()
+    file_name = os.path.basename(file_path)
+    chunk_num = 1
+
+    def make_chunk(sheet, header_line, lines, row_start):
+        nonlocal chunk_num
+        prefix = f"Sheet: {sheet}\n" if sheet else ""
+        chunk = {
+            "file_name": file_name,
+            "chunk_number": chunk_num,
+            "text": prefix + header_line + "\n" + "\n".join(lines),
+            "section_type": "table",
+            "row_start": row_start
+        }
+        chunk_num += 1
+        stats["chunks"] += 1
+        elapsed = time.time() - start_time
+        stats["seconds"] = elapsed
+        stats["rows_per_second"] = stats["rows"] / elapsed if elapsed > 0 else 0
+        return chunk
+
+    for sheet, header, rows in tables:
+        header_line = _format_row(header)
+        lines = []
+        size = len(header_line)
+        row_start = 1
+        for row_number, row in enumerate(rows, 1):
+            line = _format_row(row)
+            if not line.replace("|", "").strip():
+                continue
+            if lines and size + len(line) + 1 > max_chars:
+                yield make_chunk(sheet, header_line, lines, row_start)
+                lines, size, row_start = [], len(header_line), row_number
+            lines.append(line)
+            size += len(line) + 1
+            stats["rows"] += 1
+        if lines:
+            yield make_chunk(sheet, header_line, lines, row_start)
+
+    elapsed = time.time() - start_time
+    stats["seconds"] = elapsed
+    stats["rows_per_second"] = stats["rows"] / elapsed if elapsed > 0 else 0
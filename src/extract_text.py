@@ -3,7 +3,6 @@ from pathlib import Path
 from langchain_community.document_loaders import (
     UnstructuredWordDocumentLoader,
     PyPDFLoader,
-    CSVLoader,
     UnstructuredExcelLoader,
     TextLoader,
 )
@@ -11,9 +10,11 @@ from langchain_community.document_loaders.pdf import PyMuPDFLoader
 
 if os.path.basename(os.getcwd()) == "src":
     from utils import save_text
+    from extract_tabular import stream_tabular_chunks
     output_dir = Path("../outputs/extracted")
 else:
     from src.utils import save_text
+    from src.extract_tabular import stream_tabular_chunks
     output_dir = Path("outputs/extracted")
 
 def extract_text_from_file(file_path):
@@ -50,13 +51,12 @@ def extract_text_from_file(file_path):
                     caption = f"[Figure Caption - Page {page_num}]: {text}"
                     text_output.append(caption)
 
-        elif extension == '.csv':
-            loader = CSVLoader(file_path, encoding='utf-8')
-            docs = loader.load()
-            text_output.extend([doc.page_content for doc in docs])
+        elif extension in ['.csv', '.xlsx', '.xlsm']:
+            # Stream rows (csv module / openpyxl read-only) instead of loading every row as a Document
+            text_output.extend(chunk["text"] for chunk in stream_tabular_chunks(str(file_path)))
 
-        elif extension in ['.xlsx', '.xls', '.xlsm']:
-            # Explicitly use UnstructuredExcelLoader for Excel files
+        elif extension == '.xls':
+            # Legacy .xls is not readable by openpyxl; use UnstructuredExcelLoader
             loader = UnstructuredExcelLoader(file_path, mode="elements")
             docs = loader.load()
             text_output.extend([doc.page_content for doc in docs])
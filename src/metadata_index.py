@@ -0,0 +1,119 @@
+import faiss
+import numpy as np
+
+INDEXED_FIELDS = ("file_name", "section_type", "page_number")
+NUMERIC_FIELDS = ("page_number",)
+
+
+def bitset_from_positions(positions, size):
+    """Pack a collection of FAISS positions into an int bitset (bit i == position i)."""
+    if not size:
+        return 0
+    mask = np.zeros(size, dtype=bool)
+    mask[np.fromiter(positions, dtype=np.int64)] = True
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+def positions_from_bitset(bits, size):
+    """Unpack an int bitset back into a sorted array of positions."""
+    packed = np.frombuffer(bits.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder="little")[:size])
+
+
+def bitset_to_selector(bits, size):
+    """Turn an int bitset into a FAISS ID selector; the bitmap must outlive the search."""
+    bitmap = np.frombuffer(bits.to_bytes((size + 7) // 8, "little"), dtype=np.uint8).copy()
+    return faiss.IDSelectorBitmap(size, faiss.swig_ptr(bitmap)), bitmap
+
+
+def _parse_scalar(field, raw):
+    raw = raw.strip()
+    return int(raw) if field in NUMERIC_FIELDS else raw
+
+
+def parse_filter_expression(expression):
+    """Parse 'field=value', 'field=a,b' or 'page_number=3-10' into (field, condition)."""
+    field, sep, raw = expression.partition("=")
+    field = field.strip()
+    if not sep or field not in INDEXED_FIELDS:
+        raise ValueError(f"Invalid filter '{expression}'; expected one of {', '.join(INDEXED_FIELDS)}=value")
+    if field in NUMERIC_FIELDS and "-" in raw:
+        low, _, high = raw.partition("-")
+        return field, (int(low) if low.strip() else None, int(high) if high.strip() else None)
+    values = [_parse_scalar(field, value) for value in raw.split(",") if value.strip()]
+    return field, values[0] if len(values) == 1 else values
+
+
+def parse_filters(expressions):
+    """Parse a list of filter expressions into the filter dict accepted by the vector store."""
+    return dict(parse_filter_expression(expression) for expression in expressions or [])
+
+
+class MetadataIndex:
+    """Per-field-value bitsets over a shard's FAISS positions, used to pre-filter searches.
+
+    Filters map a field to a condition: a scalar (equality), a list/set (membership)
+    or a (low, high) tuple (inclusive range, either side may be None).
+    """
+
+    def __init__(self, fields=INDEXED_FIELDS):
+        self.fields = fields
+        self.size = 0
+        self._bitsets = {field: {} for field in fields}
+
+    @classmethod
+    def from_metadatas(cls, metadatas, fields=INDEXED_FIELDS):
+        """Build the index in one pass over the metadata of positions 0..n-1."""
+        index = cls(fields)
+        positions = {field: {} for field in fields}
+        for position, metadata in enumerate(metadatas):
+            for field in fields:
+                value = metadata.get(field)
+                if value is not None:
+                    positions[field].setdefault(value, []).append(position)
+        index.size = len(metadatas)
+        for field, values in positions.items():
+            index._bitsets[field] = {
+                value: bitset_from_positions(value_positions, index.size)
+                for value, value_positions in values.items()
+            }
+        return index
+
+    def add(self, metadatas):
+        """Index metadata for positions appended after the current end."""
+        for offset, metadata in enumerate(metadatas):
+            bit = 1 << (self.size + offset)
+            for field in self.fields:
+                value = metadata.get(field)
+                if value is not None:
+                    bitsets = self._bitsets[field]
+                    bitsets[value] = bitsets.get(value, 0) | bit
+        self.size += len(metadatas)
+
+    def _match(self, field, condition):
+        values = self._bitsets[field]
+        if isinstance(condition, tuple):
+            low, high = condition
+            matched = [
+                bits for value, bits in values.items()
+                if (low is None or value >= low) and (high is None or value <= high)
+            ]
+        elif isinstance(condition, (list, set, frozenset)):
+            matched = [values.get(value, 0) for value in condition]
+        else:
+            matched = [values.get(condition, 0)]
+        bits = 0
+        for value_bits in matched:
+            bits |= value_bits
+        return bits
+
+    def select(self, filters):
+        """Return the bitset of positions matching every field condition."""
+        bits = (1 << self.size) - 1
+        for field, condition in filters.items():
+            if field not in self._bitsets:
+                raise ValueError(f"Field '{field}' is not indexed; filterable fields: {', '.join(self.fields)}")
+            bits &= self._match(field, condition)
+            if not bits:
+                break
+        return bits
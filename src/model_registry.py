@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+
+import httpx
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable
+from langchain_ollama import OllamaEmbeddings, OllamaLLM
+from ollama import Client, ResponseError
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+DEFAULT_KEEP_ALIVE = 1800  # seconds the server keeps the model loaded after a request
+DEFAULT_METADATA_TIMEOUT = 5  # seconds per model metadata request (ollama show)
+
+# Transient failures worth retrying; anything else (bad prompt, unknown model) is raised at once
+RETRYABLE_ERRORS = (httpx.TransportError, ConnectionError, TimeoutError)
+
+_settings = {
+    "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+    "max_retries": DEFAULT_MAX_RETRIES,
+    "backoff_seconds": DEFAULT_BACKOFF_SECONDS,
+    "keep_alive": DEFAULT_KEEP_ALIVE
+}
+_limiter = threading.BoundedSemaphore(DEFAULT_MAX_CONCURRENCY)
+_clients = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def configure(max_concurrency=None, max_retries=None, backoff_seconds=None, keep_alive=None):
+    """Set registry-wide limits. The limiter applies to all later requests; HTTP pool
+    sizes and keep-alive are fixed when a client is first created."""
+    global _limiter
+    with _lock:
+        if max_concurrency is not None and max_concurrency != _settings["max_concurrency"]:
+            _settings["max_concurrency"] = max_concurrency
+            _limiter = threading.BoundedSemaphore(max_concurrency)
+        if max_retries is not None:
+            _settings["max_retries"] = max_retries
+        if backoff_seconds is not None:
+            _settings["backoff_seconds"] = backoff_seconds
+        if keep_alive is not None:
+            _settings["keep_alive"] = keep_alive
+
+
+class _ModelStats:
+    """Request counters and latency for one model, updated from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.queued = 0
+        self.in_flight = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "queue_depth": self.queued,
+                "in_flight": self.in_flight,
+                "avg_latency_ms": round(1000 * self.total_latency / self.requests, 1) if self.requests else 0.0,
+                "max_latency_ms": round(1000 * self.max_latency, 1)
+            }
+
+
+def _is_retryable(error):
+    if isinstance(error, ResponseError):
+        # Server overloaded or failing; 4xx such as an unknown model will not fix itself
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def _call(model, func, *args, **kwargs):
+    """Run a model request under the global limiter, retrying transient failures with backoff."""
+    stats = _stats[model]
+    for attempt in range(_settings["max_retries"] + 1):
+        with stats.lock:
+            stats.queued += 1
+        limiter = _limiter
+        limiter.acquire()
+        with stats.lock:
+            stats.queued -= 1
+            stats.in_flight += 1
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            with stats.lock:
+                stats.errors += 1
+            if not _is_retryable(e) or attempt == _settings["max_retries"]:
+                raise
+            with stats.lock:
+                stats.retries += 1
+        else:
+            latency = time.time() - start
+            with stats.lock:
+                stats.requests += 1
+                stats.total_latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+            return result
+        finally:
+            with stats.lock:
+                stats.in_flight -= 1
+            limiter.release()
+        # Back off outside the limiter so other requests can use the slot meanwhile
+        time.sleep(_settings["backoff_seconds"] * (2 ** attempt) * (1 + random.random()))
+
+
+class ManagedLLM(Runnable):
+    """Shared OllamaLLM whose requests go through the registry's limiter, retries and stats."""
+
+    def __init__(self, model, client):
+        self.model = model
+        self.client = client
+
+    def invoke(self, input, config=None, **kwargs):
+        return _call(self.model, self.client.invoke, input, config, **kwargs)
+
+
+class ManagedEmbeddings(Embeddings):
+    """Shared OllamaEmbeddings whose requests go through the registry's limiter, retries and stats."""
+
+    def __init__(self, model, client):
+        self.model = model
+        self.client = client
+        # Recorded in index manifests so a store is never queried with different embeddings
+        self.identity = f"ollama/{model}"
+
+    def embed_documents(self, texts):
+        return _call(self.model, self.client.embed_documents, texts)
+
+    def embed_query(self, text):
+        return _call(self.model, self.client.embed_query, text)
+
+
+def _client_kwargs():
+    # One pooled keep-alive HTTP connection pool per client, sized to the global limit
+    limit = _settings["max_concurrency"]
+    return {"limits": httpx.Limits(max_connections=limit, max_keepalive_connections=limit)}
+
+
+def _get(kind, model, params, factory):
+    key = (kind, model, tuple(sorted(params.items())))
+    with _lock:
+        if key not in _clients:
+            _stats.setdefault(model, _ModelStats())
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def get_llm(model="llama3:8b", **params):
+    """Return the shared LLM client for (model, params)."""
+    return _get("llm", model, params, lambda: ManagedLLM(model, OllamaLLM(
+        model=model,
+        keep_alive=_settings["keep_alive"],
+        client_kwargs=_client_kwargs(),
+        **params
+    )))
+
+
+def get_embeddings(model="nomic-embed-text", **params):
+    """Return the shared embeddings client for (model, params)."""
+    return _get("embeddings", model, params, lambda: ManagedEmbeddings(model, OllamaEmbeddings(
+        model=model,
+        keep_alive=_settings["keep_alive"],
+        client_kwargs=_client_kwargs(),
+        **params
+    )))
+
+
+def show_model(model, timeout=DEFAULT_METADATA_TIMEOUT):
+    """Return a model's metadata (ollama show) from a shared client with a request timeout,
+    under the registry's limiter, retries and stats."""
+    client = _get("metadata", model, {"timeout": timeout}, lambda: Client(timeout=timeout, **_client_kwargs()))
+    return _call(model, client.show, model)
+
+
+def model_stats():
+    """Per-model request count, errors, retries, queue depth, in-flight requests and latency."""
+    with _lock:
+        return {model: stats.snapshot() for model, stats in _stats.items()}
@@ -0,0 +1,296 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+PROFILE_DIR = "outputs/profile"
+DEFAULT_SAMPLE_INTERVAL = 0.1
+DEFAULT_TOP_ALLOCATIONS = 25
+# Call paths under this share of a stage's time are dropped from the collapsed stacks
+MIN_STACK_FRACTION = 0.001
+MAX_STACK_DEPTH = 128
+
+_profiler = None
+_disabled = nullcontext()
+# Keep the profiler's own bookkeeping out of the allocation report
+_SNAPSHOT_FILTERS = (tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__))
+
+
+def _rss_mb():
+    """Current resident set size in MB (peak RSS so far where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+        except ImportError:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def _frame_label(func):
+    file_name, line, name = func
+    if file_name == "~":
+        return name
+    return f"{name} ({os.path.basename(file_name)}:{line})"
+
+
+def collapsed_stacks(stats, root):
+    """Turn a pstats call graph into flamegraph 'frame;frame;... microseconds' lines.
+
+    cProfile keeps caller/callee edges rather than full stacks, so each function's own time
+    is spread over its call paths in proportion to the time spent under each caller.
+    """
+    callees = defaultdict(dict)
+    roots = []
+    total = 0.0
+    for func, (_, _, own_time, _, callers) in stats.items():
+        total += own_time
+        if not callers:
+            roots.append(func)
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][func] = cumulative
+    lines = Counter()
+
+    def walk(func, path, seen, cumulative):
+        _, _, own_time, func_cumulative, _ = stats[func]
+        share = cumulative / func_cumulative if func_cumulative else 0.0
+        path = f"{path};{_frame_label(func)}"
+        lines[path] += own_time * share
+        if len(seen) >= MAX_STACK_DEPTH:
+            return
+        for callee, callee_cumulative in callees[func].items():
+            callee_cumulative *= share
+            # Recursion is folded into the first occurrence
+            if callee not in seen and callee_cumulative >= MIN_STACK_FRACTION * total:
+                walk(callee, path, seen | {callee}, callee_cumulative)
+
+    for func in roots:
+        walk(func, root, {func}, stats[func][3])
+    return [f"{stack} {round(seconds * 1e6)}" for stack, seconds in lines.items() if seconds * 1e6 >= 1]
+
+
+class _StageRecord:
+    def __init__(self, scope="process"):
+        self.scope = scope
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.traced_peak_mb = 0.0
+        self.rss_peak_mb = 0.0
+        self.rss_delta_mb = 0.0
+        self.stats = None
+        self.allocations = Counter()
+        self.allocation_counts = Counter()
+
+
+class RunProfiler:
+    """Profiles named pipeline stages: cProfile call graphs, tracemalloc allocation sites
+    and a sampled RSS / traced-memory timeline, written under output_dir on finish().
+
+    Stages are keyed by name, so repeated calls (one per file or question) aggregate;
+    the timeline records each call's detail, e.g. which file was being processed.
+    Only the outermost active stage is profiled; nested stages count towards it. A stage
+    entered on a worker thread while another thread's stage is active is a thread stage:
+    cProfile, wall and thread CPU time for that thread only, with its allocations counted
+    in the enclosing stage's (process-wide) snapshots.
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR, sample_interval=DEFAULT_SAMPLE_INTERVAL,
+                 top_allocations=DEFAULT_TOP_ALLOCATIONS):
+        self.output_dir = Path(output_dir)
+        self.sample_interval = sample_interval
+        self.top_allocations = top_allocations
+        self.stages = {}
+        self.timeline = []
+        self._current = None
+        self._detail = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._start_time = time.time()
+        tracemalloc.start()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = _rss_mb()
+            traced, _ = tracemalloc.get_traced_memory()
+            with self._lock:
+                stage = self._current
+                self.timeline.append({
+                    "t": round(time.time() - self._start_time, 3),
+                    "stage": stage,
+                    "detail": self._detail,
+                    "rss_mb": round(rss, 2) if rss is not None else None,
+                    "traced_mb": round(traced / 2 ** 20, 2)
+                })
+                if stage and rss is not None:
+                    record = self.stages[stage]
+                    record.rss_peak_mb = max(record.rss_peak_mb, rss)
+            self._stop.wait(self.sample_interval)
+
+    @contextmanager
+    def stage(self, name, detail=None):
+        if getattr(self._local, "stage", None) is not None:
+            # Nested in this thread's active stage
+            yield
+            return
+        with self._lock:
+            worker = self._current is not None
+            if not worker:
+                self._current, self._detail = name, detail
+                record = self.stages.setdefault(name, _StageRecord())
+        self._local.stage = name
+        try:
+            if worker:
+                with self._thread_stage(name):
+                    yield
+                return
+            with self._process_stage(name, record):
+                yield
+        finally:
+            self._local.stage = None
+
+    @contextmanager
+    def _thread_stage(self, name):
+        profile = cProfile.Profile()
+        start = time.time()
+        cpu_start = time.thread_time()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ profiles every thread from the enclosing stage; only time this one
+            profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall_seconds = time.time() - start
+            cpu_seconds = time.thread_time() - cpu_start
+            with self._lock:
+                record = self.stages.setdefault(name, _StageRecord("thread"))
+                record.calls += 1
+                record.wall_seconds += wall_seconds
+                record.cpu_seconds += cpu_seconds
+                if profile is not None and record.stats is None:
+                    record.stats = pstats.Stats(profile)
+                elif profile is not None:
+                    record.stats.add(profile)
+
+    @contextmanager
+    def _process_stage(self, name, record):
+        rss_before = _rss_mb()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        profile = cProfile.Profile()
+        start = time.time()
+        cpu_start = time.process_time()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall_seconds = time.time() - start
+            cpu_seconds = time.process_time() - cpu_start
+            after = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+            _, traced_peak = tracemalloc.get_traced_memory()
+            rss_after = _rss_mb()
+            with self._lock:
+                self._current, self._detail = None, None
+                record.calls += 1
+                record.wall_seconds += wall_seconds
+                record.cpu_seconds += cpu_seconds
+                record.traced_peak_mb = max(record.traced_peak_mb, traced_peak / 2 ** 20)
+                if rss_after is not None:
+                    record.rss_peak_mb = max(record.rss_peak_mb, rss_before, rss_after)
+                    record.rss_delta_mb += rss_after - rss_before
+                if record.stats is None:
+                    record.stats = pstats.Stats(profile)
+                else:
+                    record.stats.add(profile)
+                for diff in after.compare_to(before, "lineno"):
+                    site = f"{diff.traceback[0].filename}:{diff.traceback[0].lineno}"
+                    record.allocations[site] += diff.size_diff
+                    record.allocation_counts[site] += diff.count_diff
+
+    def finish(self):
+        """Stop sampling and write collapsed stacks, allocations, timeline and stage summary."""
+        self._stop.set()
+        self._sampler.join()
+        tracemalloc.stop()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        summary, allocations, all_stacks = [], {}, []
+        for name, record in self.stages.items():
+            file_stem = re.sub(r"[^\w.-]+", "_", name)[:80]
+            summary.append({
+                "stage": name,
+                "scope": record.scope,
+                "calls": record.calls,
+                # Thread stages sum over concurrent calls, so they can exceed the enclosing stage
+                "wall_seconds": round(record.wall_seconds, 3),
+                # Process stages count every thread's CPU; wall minus CPU is mostly I/O and model waits
+                "cpu_seconds": round(record.cpu_seconds, 3),
+                "traced_peak_mb": round(record.traced_peak_mb, 2),
+                "rss_peak_mb": round(record.rss_peak_mb, 2),
+                "rss_delta_mb": round(record.rss_delta_mb, 2)
+            })
+            allocations[name] = [
+                {"site": site, "size_kb": round(size / 1024, 1), "count": record.allocation_counts[site]}
+                for site, size in record.allocations.most_common(self.top_allocations)
+            ]
+            if record.stats is None:
+                continue
+            record.stats.dump_stats(str(self.output_dir / f"{file_stem}.prof"))
+            stacks = collapsed_stacks(record.stats.stats, file_stem)
+            all_stacks.extend(stacks)
+            with open(self.output_dir / f"{file_stem}.collapsed", "w", encoding="utf-8") as f:
+                f.write("\n".join(stacks) + "\n")
+
+        with open(self.output_dir / "all_stages.collapsed", "w", encoding="utf-8") as f:
+            f.write("\n".join(all_stacks) + "\n")
+        outputs = {"stages.json": summary, "allocations.json": allocations, "memory_timeline.json": self.timeline}
+        for file_name, data in outputs.items():
+            with open(self.output_dir / file_name, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4)
+        return summary
+
+
+def enable(output_dir=PROFILE_DIR, sample_interval=DEFAULT_SAMPLE_INTERVAL, top_allocations=DEFAULT_TOP_ALLOCATIONS):
+    """Start profiling this process; stages run through profile_stage() are recorded."""
+    global _profiler
+    if _profiler is None:
+        _profiler = RunProfiler(output_dir, sample_interval, top_allocations)
+    return _profiler
+
+
+def profile_stage(name, detail=None):
+    """Context manager profiling one pipeline stage; a shared no-op when profiling is off.
+
+    Keep name fixed across calls so they aggregate; put the file or question in detail.
+    """
+    if _profiler is None:
+        return _disabled
+    return _profiler.stage(name, detail)
+
+
+def finish():
+    """Write the profile outputs and stop profiling. Returns the per-stage summary, or None."""
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, _profiler = _profiler, None
+    return profiler.finish()
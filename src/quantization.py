@@ -0,0 +1,175 @@
+import os
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+VECTOR_ENCODINGS = ("flat", "fp16", "int8", "binary")
+VECTORS_FILE = "vectors.f32"
+DEFAULT_RESCORE_FACTOR = 4
+
+
+def make_index(encoding, dim, training_vectors=None):
+    """Create the FAISS index used to scan a shard's vectors in the given encoding.
+
+    int8 is trained on training_vectors; without any it must be trained before the first add.
+    """
+    if encoding == "flat":
+        return faiss.IndexFlatL2(dim)
+    if encoding == "fp16":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if encoding == "int8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        # Per-dimension min/max of the training vectors; vectors added later outside that range
+        # are clipped until the shard is compacted, which rebuilds the index from all its rows
+        if training_vectors is not None and len(training_vectors):
+            index.train(np.asarray(training_vectors, dtype=np.float32))
+        return index
+    if encoding == "binary":
+        # One sign bit per dimension (no rotation, zero thresholds), searched by Hamming distance
+        return faiss.IndexLSH(dim, dim, False, False)
+    raise ValueError(f"Unknown vector encoding '{encoding}'; expected one of {', '.join(VECTOR_ENCODINGS)}")
+
+
+def needs_training(encoding):
+    """int8 derives its value ranges from the vectors it is trained on; the others need no training."""
+    return encoding == "int8"
+
+
+def supports_selector(encoding):
+    """IndexLSH (binary) cannot take an ID selector; filtered searches score exactly instead."""
+    return encoding != "binary"
+
+
+class FullPrecisionVectors:
+    """Append-only float32 matrix on disk, memory-mapped for exact rescoring.
+
+    Row i holds the full-precision vector of FAISS position i in the same shard.
+    """
+
+    def __init__(self, path, dim):
+        self.path = Path(path)
+        self.dim = dim
+        self._count = self.path.stat().st_size // (4 * dim) if self.path.exists() else 0
+        self._mmap = None
+
+    def __len__(self):
+        return self._count
+
+    def truncate(self, count):
+        """Match the file to an index holding count vectors: drop rows past count (left by an
+        interrupted append) and raise if rows are missing, since positions would then misalign."""
+        if self._count < count:
+            raise ValueError(
+                f"{self.path} holds {self._count} vectors but the index has {count}; rebuild the shard"
+            )
+        if self._count > count:
+            os.truncate(self.path, count * 4 * self.dim)
+            self._count = count
+            self._mmap = None
+
+    def append(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with open(self.path, "ab") as f:
+            f.write(vectors.tobytes())
+        self._count += len(vectors)
+        self._mmap = None
+
+    def array(self):
+        """Return the vectors as a read-only memory map (empty array when there are none)."""
+        if self._count == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._mmap is None:
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self._count, self.dim))
+        return self._mmap
+
+    def rows(self, positions):
+        """Copy of the given rows as a float32 array."""
+        return np.asarray(self.array()[np.asarray(positions, dtype=np.int64)])
+
+    def distances(self, query, positions):
+        """Exact squared L2 distances between a query vector and the given rows."""
+        return _squared_distances(self.rows(positions), query)
+
+
+class StackedVectors:
+    """Row-wise concatenation of FullPrecisionVectors, read-only.
+
+    A shard's base segment followed by its delta journal, so that row i is still FAISS
+    position i. Parts may grow by appending; later parts' rows shift accordingly.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.dim = parts[0].dim
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def rows(self, positions):
+        positions = np.asarray(positions, dtype=np.int64)
+        out = np.empty((len(positions), self.dim), dtype=np.float32)
+        start = 0
+        for part in self.parts:
+            end = start + len(part)
+            mask = (positions >= start) & (positions < end)
+            if mask.any():
+                out[mask] = part.array()[positions[mask] - start]
+            start = end
+        return out
+
+    def distances(self, query, positions):
+        return _squared_distances(self.rows(positions), query)
+
+
+def _squared_distances(rows, query):
+    return ((rows - np.asarray(query, dtype=np.float32)) ** 2).sum(axis=1)
+
+
+def _recall(truth, found, query_ids, k):
+    hits = 0
+    for query_id, true_row, found_row in zip(query_ids, truth, found):
+        true_ids = [i for i in true_row if i != query_id][:k]
+        found_ids = [i for i in found_row if i != query_id and i != -1][:k]
+        hits += len(set(true_ids) & set(found_ids))
+    return hits / (k * len(query_ids))
+
+
+def compression_report(vectors, encodings=VECTOR_ENCODINGS[1:], k=5, num_queries=200,
+                       rescore_factor=DEFAULT_RESCORE_FACTOR, seed=0):
+    """Measure memory saved and recall@k retained by each encoding on a set of corpus vectors.
+
+    Queries are sampled from the corpus itself; each query's own vector is excluded from
+    both the exact and the compressed neighbour lists.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(count, size=min(num_queries, count), replace=False)
+    queries = vectors[query_ids]
+    _, truth = exact.search(queries, k + 1)
+
+    float32_bytes = count * dim * 4
+    report = {"vectors": count, "dim": dim, "float32_bytes": float32_bytes, "encodings": {}}
+    for encoding in encodings:
+        index = make_index(encoding, dim, vectors)
+        index.add(vectors)
+        code_bytes = index.sa_code_size() * count
+        _, found = index.search(queries, k + 1)
+        result = {
+            "bytes": code_bytes,
+            "memory_saved_pct": round(100 * (1 - code_bytes / float32_bytes), 2),
+            f"recall@{k}": round(_recall(truth, found, query_ids, k), 4)
+        }
+        if rescore_factor:
+            _, candidates = index.search(queries, min((k + 1) * rescore_factor, count))
+            rescored = []
+            for query, row in zip(queries, candidates):
+                row = row[row != -1]
+                order = np.argsort(((vectors[row] - query) ** 2).sum(axis=1))
+                rescored.append(row[order])
+            result[f"recall@{k}_rescored"] = round(_recall(truth, rescored, query_ids, k), 4)
+        report["encodings"][encoding] = result
+    return report
@@ -1,25 +1,40 @@
 import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from langchain_community.vectorstores import FAISS
-from langchain_ollama import OllamaEmbeddings
 from langchain_core.prompts import PromptTemplate
-from langchain_ollama import OllamaLLM
 from langchain_core.runnables import Runnable
 
+try:
+    from src.sharded_store import ShardedVectorStore
+    from src.quantization import DEFAULT_RESCORE_FACTOR
+    from src.utils import batched
+    from src.conversation_memory import DEFAULT_MEMORY_TOKENS, ConversationMemory
+    from src.model_registry import get_llm
+    from src.embedding_backends import get_embedding_backend
+except ImportError:
+    from sharded_store import ShardedVectorStore
+    from quantization import DEFAULT_RESCORE_FACTOR
+    from utils import batched
+    from conversation_memory import DEFAULT_MEMORY_TOKENS, ConversationMemory
+    from model_registry import get_llm
+    from embedding_backends import get_embedding_backend
+
 class RAGSystem:
-    def __init__(self, vector_db_path="../outputs/vector_db"):
-        # Initialize embeddings
-        self.embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        
-        # Load FAISS vector store
-        self.vector_store = FAISS.load_local(
+    def __init__(self, vector_db_path="../outputs/vector_db", max_loaded_shards=None, rescore_factor=DEFAULT_RESCORE_FACTOR,
+                 memory_tokens=DEFAULT_MEMORY_TOKENS, embedding_backend=None):
+        # Open sharded FAISS vector store (shards load lazily on first search); queries are
+        # embedded with the backend recorded in its manifest unless one is given
+        self.vector_store = ShardedVectorStore(
             vector_db_path,
-            self.embeddings,
-            allow_dangerous_deserialization=True
+            get_embedding_backend(embedding_backend) if embedding_backend else None,
+            max_loaded_shards=max_loaded_shards,
+            rescore_factor=rescore_factor
         )
+        self.embeddings = self.vector_store.embeddings
 
-        # Initialize LLM
-        self.llm = OllamaLLM(model="llama3:8b")
+        # Shared LLM client from the model registry
+        self.llm = get_llm("llama3:8b")
 
         # Define prompt template
         self.prompt = PromptTemplate.from_template(
@@ -28,6 +43,9 @@ class RAGSystem:
             Context:
             {context}
 
+            Conversation so far:
+            {history}
+
             Instructions:
             - Do **not** assume the identity of the person in the context (e.g., resume).
             - If the user greets (e.g., "hello", "hi"), respond politely (maximum 10 words).
@@ -38,11 +56,25 @@ class RAGSystem:
 
         # Create chain
         self.chain: Runnable = self.prompt | self.llm
-        self.history = []
 
-    def query(self, question: str) -> str:
-        # Perform similarity search
-        docs = self.vector_store.similarity_search(question, k=5)
+        # Token-budgeted conversation memory (recent turns + rolling summary)
+        self.memory = ConversationMemory(self.llm, max_tokens=memory_tokens)
+
+    @property
+    def history(self):
+        """Verbatim turns still held in memory, as role/content messages."""
+        messages = []
+        for question, answer in self.memory.turns:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return messages
+
+    def query(self, question: str, filters: dict = None) -> str:
+        # Rewrite follow-ups ("what about the second one?") into standalone retrieval queries
+        retrieval_query = self.memory.rewrite_query(question)
+
+        # Perform similarity search across all shards, pre-filtered on metadata if requested
+        docs = self.vector_store.similarity_search(retrieval_query, k=5, filters=filters)
         
         # Extract contexts and metadata for debugging
         contexts = []
@@ -58,15 +90,103 @@ class RAGSystem:
         # Invoke LLM
         result = self.chain.invoke({
             "context": context_str,
+            "history": self.memory.condensed_history() or "(none)",
             "question": question
         })
         answer = result
 
-        # Update history
-        self.history.append({"role": "user", "content": question})
-        self.history.append({"role": "assistant", "content": answer})
+        # Update bounded memory
+        self.memory.add_turn(question, answer)
         return answer
 
+    def _answer_retrieved(self, item, hits, retrieval_seconds):
+        """Generate one batch answer from already retrieved hits; errors are reported, not raised."""
+        start = time.time()
+        result = {
+            "id": item.get("id"),
+            "question": item["question"],
+            "chunks": [
+                {
+                    "chunk_id": chunk_id,
+                    "file_name": doc.metadata.get("file_name"),
+                    "chunk_number": doc.metadata.get("chunk_number"),
+                    "score": distance
+                }
+                for doc, distance, chunk_id in hits
+            ]
+        }
+        try:
+            result["answer"] = self.chain.invoke({
+                "context": "\n".join(doc.page_content for doc, _, _ in hits),
+                "history": "(none)",
+                "question": item["question"]
+            })
+        except Exception as e:
+            result["answer"] = None
+            result["error"] = str(e)
+        result["timings"] = {
+            "retrieval_seconds": retrieval_seconds,
+            "generation_seconds": time.time() - start
+        }
+        return result
+
+    def query_batch(self, questions, k=5, filters=None, max_concurrency=4, block_size=512):
+        """Answer many questions offline, yielding result dicts as generations complete.
+
+        questions is an iterable of dicts with "question" (and optional "id"). Each block
+        of questions is embedded in one call and searched with one vectorised FAISS
+        search per shard; generations run on at most max_concurrency threads. The
+        per-question retrieval time is the block's retrieval time amortised over it.
+        History is not updated in batch mode. Invalid items (or items already carrying an
+        "error") and failed retrievals yield error results instead of stopping the batch.
+        """
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            pending = set()
+            for items in batched(questions, block_size):
+                block = []
+                for item in items:
+                    error = _question_error(item)
+                    if error:
+                        yield _error_result(item, error)
+                    else:
+                        block.append(item)
+                if not block:
+                    continue
+                start = time.time()
+                try:
+                    vectors = self.embeddings.embed_documents([item["question"] for item in block])
+                    hits_per_question = self.vector_store.batch_similarity_search_by_vectors(vectors, k, filters)
+                except Exception as e:
+                    for item in block:
+                        yield _error_result(item, f"Retrieval failed: {e}")
+                    continue
+                retrieval_seconds = (time.time() - start) / len(block)
+                for item, hits in zip(block, hits_per_question):
+                    pending.add(pool.submit(self._answer_retrieved, item, hits, retrieval_seconds))
+                # Keep at most one block of generations queued so memory stays bounded
+                while len(pending) > block_size:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+
+def _question_error(item):
+    """Why a batch item cannot be answered, or None if it can."""
+    if not isinstance(item, dict):
+        return f"Expected an object with a 'question', got {type(item).__name__}"
+    if item.get("error"):
+        return item["error"]
+    if not isinstance(item.get("question"), str) or not item["question"].strip():
+        return "Missing or empty 'question'"
+    return None
+
+
+def _error_result(item, error):
+    item = item if isinstance(item, dict) else {}
+    return {"id": item.get("id"), "question": item.get("question"), "chunks": [], "answer": None, "error": error}
+
 if __name__ == "__main__":
     # Initialize RAG system with path to vector store
     rag = RAGSystem(vector_db_path=Path(__file__).parent.parent / "outputs" / "vector_db")
@@ -0,0 +1,1005 @@
+import json
+import heapq
+import os
+import re
+import threading
+import uuid
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+try:
+    from src.metadata_index import MetadataIndex, bitset_from_positions, bitset_to_selector, positions_from_bitset
+    from src.quantization import DEFAULT_RESCORE_FACTOR, VECTORS_FILE, FullPrecisionVectors, StackedVectors, make_index, needs_training, supports_selector
+    from src.embedding_backends import DEFAULT_EMBEDDING_BACKEND, embedding_identity, get_embedding_backend
+    from src.utils import batched
+    from src.profiling import profile_stage
+except ImportError:
+    from metadata_index import MetadataIndex, bitset_from_positions, bitset_to_selector, positions_from_bitset
+    from quantization import DEFAULT_RESCORE_FACTOR, VECTORS_FILE, FullPrecisionVectors, StackedVectors, make_index, needs_training, supports_selector
+    from embedding_backends import DEFAULT_EMBEDDING_BACKEND, embedding_identity, get_embedding_backend
+    from utils import batched
+    from profiling import profile_stage
+
+MANIFEST_NAME = "manifest.json"
+SHARD_META_NAME = "shard.json"
+SHARDS_DIR = "shards"
+DEFAULT_NUM_SHARDS = 8
+DEFAULT_COMPACTION_THRESHOLD = 0.2
+MANIFEST_VERSION = 1
+# Documents read from the input and embedded per step of a bulk build
+DEFAULT_BUILD_BATCH = 512
+# A shard's index is created (and int8 trained) once it has this many vectors, or at the end.
+# Smaller int8 shards written incrementally stay journal-only and are trained on load.
+MIN_TRAINING_VECTORS = 2048
+# Base segments (index, float32 rows) and delta journals of every shard generation
+SEGMENT_PATTERN = re.compile(r"(index|vectors|delta)(_\d+)?\.(faiss|pkl|f32|jsonl|idx)$")
+
+
+def shard_for_file(file_name, num_shards=DEFAULT_NUM_SHARDS):
+    """Return the shard id a source file is routed to (stable hash of the file name)."""
+    return f"shard_{zlib.crc32(file_name.encode('utf-8')) % num_shards:04d}"
+
+
+def chunk_to_document(chunk):
+    """Convert a chunk dict to a LangChain Document with the metadata used for retrieval."""
+    return Document(
+        page_content=chunk["text"],
+        metadata={
+            "file_name": chunk["file_name"],
+            "page_number": chunk.get("page_number", 0),
+            "chunk_number": chunk["chunk_number"],
+            "section_type": chunk.get("section_type", "text")
+        }
+    )
+
+
+def chunks_to_documents(chunks):
+    """Convert chunk dicts to LangChain Documents."""
+    return [chunk_to_document(chunk) for chunk in chunks]
+
+
+def _write_json(path, data):
+    """Write JSON atomically so readers never see a half-written manifest."""
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _ranges(positions):
+    """Compress ascending positions into [start, end) ranges."""
+    ranges = []
+    _extend_ranges(ranges, ([position, position + 1] for position in positions))
+    return ranges
+
+
+def _extend_ranges(ranges, new):
+    """Append ranges starting at or after the last one, merging adjacent ones."""
+    for start, end in new:
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+
+def _positions(ranges):
+    return [position for start, end in ranges for position in range(start, end)]
+
+
+def _range_count(ranges):
+    return sum(end - start for start, end in ranges)
+
+
+def _file_ranges(documents, start=0):
+    """Map each file name to the ranges of FAISS positions its documents occupy."""
+    files = {}
+    for position, doc in enumerate(documents, start):
+        _extend_ranges(files.setdefault(doc.metadata["file_name"], []), [[position, position + 1]])
+    return files
+
+
+def _segment_names(generation):
+    """File names of one generation of a shard; generation 0 keeps the original names."""
+    if not generation:
+        return {"index": "index", "vectors": VECTORS_FILE, "delta": "delta"}
+    return {"index": f"index_{generation}", "vectors": f"vectors_{generation}.f32", "delta": f"delta_{generation}"}
+
+
+def _remove_segments(shard_dir, keep_generation=None):
+    """Best-effort removal of a shard's segment files other than keep_generation's (all if None).
+
+    Searches may still hold an old mapping open; where the OS refuses to delete it
+    (Windows) the file is left behind and removed after a later compaction.
+    """
+    keep = set()
+    if keep_generation is not None:
+        names = _segment_names(keep_generation)
+        keep = {f"{names['index']}.faiss", f"{names['index']}.pkl", names["vectors"]}
+        keep.update(f"{names['delta']}{suffix}" for suffix in _DeltaJournal.SUFFIXES)
+    for path in Path(shard_dir).iterdir():
+        if SEGMENT_PATTERN.match(path.name) and path.name not in keep:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class _DeltaJournal:
+    """Append-only delta segment of a shard, merged into its base index at compaction.
+
+    Each record is a JSON line (docstore id, text, metadata) in <name>.jsonl with its
+    vector in <name>.f32. <name>.idx holds the end offset of every record and is written
+    last, so its length is the committed record count; anything past it is dropped on open.
+    """
+
+    SUFFIXES = (".jsonl", ".f32", ".idx")
+
+    def __init__(self, shard_dir, name, dim):
+        shard_dir = Path(shard_dir)
+        self.records_path = shard_dir / f"{name}.jsonl"
+        self.offsets_path = shard_dir / f"{name}.idx"
+        self.vectors = FullPrecisionVectors(shard_dir / f"{name}.f32", dim)
+        size = self.offsets_path.stat().st_size if self.offsets_path.exists() else 0
+        self.count = size // 8
+        if size % 8:
+            os.truncate(self.offsets_path, self.count * 8)
+        self._end = 0
+        if self.count:
+            with open(self.offsets_path, "rb") as f:
+                f.seek((self.count - 1) * 8)
+                self._end = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        if self.records_path.exists() and self.records_path.stat().st_size > self._end:
+            os.truncate(self.records_path, self._end)
+        self.vectors.truncate(self.count)
+
+    def append(self, ids, documents, vectors):
+        """Append pre-embedded documents under the given docstore ids."""
+        lines = [
+            json.dumps({"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+            for doc_id, doc in zip(ids, documents)
+        ]
+        ends = self._end + np.cumsum([len(line) for line in lines], dtype=np.uint64)
+        with open(self.records_path, "ab") as f:
+            f.write(b"".join(lines))
+        self.vectors.append(vectors)
+        # Commit point: the records only count once their offsets are written
+        with open(self.offsets_path, "ab") as f:
+            f.write(ends.astype("<u8").tobytes())
+        self._end = int(ends[-1])
+        self.count += len(lines)
+
+    def read(self):
+        """Return the committed records as (ids, documents, vectors)."""
+        if not self.count:
+            return [], [], np.empty((0, self.vectors.dim), dtype=np.float32)
+        with open(self.records_path, "rb") as f:
+            records = [json.loads(line) for line in f.read(self._end).splitlines()]
+        documents = [Document(page_content=record["text"], metadata=record["metadata"]) for record in records]
+        return [record["id"] for record in records], documents, self.vectors.rows(np.arange(self.count))
+
+
+class _ShardState:
+    """Write-side state of a shard, persisted in shard.json: live files, tombstones and
+    the current generation, plus the shard's delta journal. Needs no FAISS index loaded.
+
+    Positions are kept as [start, end) ranges (a file's documents are appended together),
+    so shard.json grows with the number of files and deletions, not with the vectors.
+    """
+
+    def __init__(self, shard_dir, meta):
+        self.shard_dir = Path(shard_dir)
+        self.encoding = meta.get("encoding", "flat")
+        self.generation = meta.get("generation", 0)
+        self.files = meta.get("file_ranges")
+        if self.files is None:
+            # shard.json written before ranges: one entry per position
+            self.files = {name: _ranges(sorted(positions)) for name, positions in meta.get("files", {}).items()}
+        # In deletion order; the set is what searches test against
+        self.tombstone_ranges = meta.get("tombstone_ranges") or _ranges(sorted(meta.get("tombstones", [])))
+        self.tombstones = set(_positions(self.tombstone_ranges))
+        self.base_vectors = meta.get("base_vectors")
+        self.dim = meta.get("dim")
+        if self.base_vectors is None or self.dim is None:
+            # Shards written before the journal existed: read the sizes from the index once
+            index = faiss.read_index(str(self.shard_dir / f"{self.names['index']}.faiss"))
+            self.base_vectors, self.dim = index.ntotal, index.d
+        self.journal = _DeltaJournal(self.shard_dir, self.names["delta"], self.dim)
+        if sum(_range_count(r) for r in self.files.values()) + len(self.tombstones) < self.num_positions:
+            # Journal records committed after the last shard.json write (persist=False, then a crash)
+            known = set(self.tombstones).union(*map(_positions, self.files.values()))
+            _, documents, _ = self.journal.read()
+            for position, doc in enumerate(documents, self.base_vectors):
+                if position not in known:
+                    _extend_ranges(self.files.setdefault(doc.metadata["file_name"], []), [[position, position + 1]])
+
+    @classmethod
+    def load(cls, shard_dir):
+        return cls(shard_dir, _read_json(Path(shard_dir) / SHARD_META_NAME, {}))
+
+    @property
+    def names(self):
+        return _segment_names(self.generation)
+
+    @property
+    def num_positions(self):
+        return self.base_vectors + self.journal.count
+
+    def manifest_entry(self):
+        return _manifest_entry(self.shard_dir.name, self.files, self.tombstones)
+
+    def save(self):
+        _write_json(self.shard_dir / SHARD_META_NAME, {
+            "encoding": self.encoding,
+            "generation": self.generation,
+            "dim": self.dim,
+            "base_vectors": self.base_vectors,
+            "file_ranges": self.files,
+            "tombstone_ranges": self.tombstone_ranges
+        })
+
+
+def _manifest_entry(shard_name, files, tombstones):
+    return {
+        "path": f"{SHARDS_DIR}/{shard_name}",
+        "num_vectors": sum(_range_count(r) for r in files.values()),
+        "num_tombstones": len(tombstones),
+        "files": sorted(files)
+    }
+
+
+class _ShardBuilder:
+    """Builds one shard from batches of documents, for bulk builds.
+
+    For compressed encodings the FAISS index holds only the codes and the float32
+    vectors are written alongside (vectors.f32) for memory-mapped exact rescoring.
+    Vectors are buffered only until MIN_TRAINING_VECTORS so int8 trains on a fair sample.
+    add() may be called from several threads: batches embed concurrently and only
+    appending them to the shard is serialised.
+    """
+
+    def __init__(self, shard_dir, embeddings, encoding="flat"):
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        _remove_segments(self.shard_dir)
+        self.embeddings = embeddings
+        self.encoding = encoding
+        self.store = None
+        self.files = {}
+        self.count = 0
+        self._full_vectors = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, documents, vectors=None):
+        """Append a batch; pass vectors to skip embedding when the caller already has them."""
+        if vectors is None:
+            # Own stages, since bulk builds call this from pool threads the caller's stage cannot see
+            with profile_stage("build_shard_embed"):
+                vectors = self.embeddings.embed_documents([doc.page_content for doc in documents])
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.encoding != "flat":
+                if self._full_vectors is None:
+                    self._full_vectors = FullPrecisionVectors(self.shard_dir / VECTORS_FILE, vectors.shape[1])
+                # float32 rows go first: an interrupted build can only leave extra rows, which loading drops
+                self._full_vectors.append(vectors)
+            self._pending.append((documents, vectors))
+            if self.store is not None or sum(len(v) for _, v in self._pending) >= MIN_TRAINING_VECTORS:
+                with profile_stage("build_shard_index"):
+                    self._add_pending()
+
+    def _add_pending(self):
+        documents = [doc for docs, _ in self._pending for doc in docs]
+        vectors = np.vstack([v for _, v in self._pending])
+        self._pending = []
+        if self.store is None:
+            self.store = FAISS(
+                embedding_function=self.embeddings,
+                index=make_index(self.encoding, vectors.shape[1], vectors),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
+        self.store.add_embeddings(
+            list(zip([doc.page_content for doc in documents], vectors)),
+            metadatas=[doc.metadata for doc in documents]
+        )
+        for file_name, ranges in _file_ranges(documents, self.count).items():
+            _extend_ranges(self.files.setdefault(file_name, []), ranges)
+        self.count += len(documents)
+
+    def save(self):
+        with profile_stage("build_shard_index"):
+            if self._pending:
+                self._add_pending()
+            self.store.save_local(str(self.shard_dir))
+        _ShardState(self.shard_dir, {
+            "encoding": self.encoding,
+            "dim": self.store.index.d,
+            "base_vectors": self.count,
+            "file_ranges": self.files
+        }).save()
+        return self.store
+
+
+def build_shard(shard_dir, documents, embeddings, encoding="flat", vectors=None):
+    """Build and save one shard independently of the others.
+
+    Pass vectors to skip embedding when the caller has already embedded the documents.
+    """
+    builder = _ShardBuilder(shard_dir, embeddings, encoding)
+    builder.add(documents, vectors)
+    return builder.save()
+
+
+def write_manifest(store_path, num_shards, embedding_model=None, vector_encoding="flat", embedding_backend=None):
+    """Regenerate the manifest from the shards present on disk."""
+    store_path = Path(store_path)
+    shards = {}
+    shards_root = store_path / SHARDS_DIR
+    if shards_root.exists():
+        for shard_dir in sorted(p for p in shards_root.iterdir() if p.is_dir()):
+            shards[shard_dir.name] = _ShardState.load(shard_dir).manifest_entry()
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "sharding": "file_name_crc32",
+        "num_shards": num_shards,
+        "embedding_model": embedding_model,
+        "embedding_backend": embedding_backend,
+        "vector_encoding": vector_encoding,
+        "shards": shards
+    }
+    _write_json(store_path / MANIFEST_NAME, manifest)
+    return manifest
+
+
+def build_sharded_store(documents, embeddings, store_path, num_shards=DEFAULT_NUM_SHARDS,
+                        max_workers=None, embedding_model=None, encoding="flat", embedding_backend=None,
+                        batch_size=DEFAULT_BUILD_BATCH):
+    """Route documents to shards by source file and build the shards in parallel.
+
+    documents may be any iterable, e.g. a generator over the chunk store: it is read
+    batch_size documents at a time, never materialised as a whole.
+    """
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    builders = {}
+    max_workers = max_workers or min(num_shards, 8)
+    # Each shard's share of a batch is split so every worker embeds, whichever shards the
+    # batch routes to (chunks arrive in file order, so a batch rarely spans many shards)
+    sub_batch = max(1, batch_size // max_workers)
+    in_flight = deque()
+
+    # Embedding is I/O bound against the model server and FAISS releases the GIL,
+    # so threads are enough to keep the pool busy.
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for batch in batched(documents, batch_size):
+            groups = {}
+            for doc in batch:
+                groups.setdefault(shard_for_file(doc.metadata["file_name"], num_shards), []).append(doc)
+            for shard_id, docs in groups.items():
+                if shard_id not in builders:
+                    builders[shard_id] = _ShardBuilder(store_path / SHARDS_DIR / shard_id, embeddings, encoding)
+                for part in batched(docs, sub_batch):
+                    in_flight.append(pool.submit(builders[shard_id].add, part))
+            # Keep reading ahead while the pool works, but only about two batches' worth
+            while len(in_flight) > 2 * max_workers:
+                in_flight.popleft().result()
+        while in_flight:
+            in_flight.popleft().result()
+        for future in [pool.submit(builder.save) for builder in builders.values()]:
+            future.result()
+
+    return write_manifest(store_path, num_shards, embedding_model, encoding,
+                          embedding_backend or embedding_identity(embeddings))
+
+
+class _ReadWriteLock:
+    """Any number of readers or one writer. A waiting writer holds back new readers, so a
+    steady stream of searches cannot starve an append. Not reentrant."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class _Shard:
+    """A loaded shard: FAISS index (base segment plus replayed journal), its write-side
+    state and the metadata index over every position."""
+
+    def __init__(self, store, state, full_vectors=None):
+        self.store = store
+        self.state = state
+        self.full_vectors = full_vectors
+        self.metadata_index = MetadataIndex.from_metadatas([
+            store.docstore.search(store.index_to_docstore_id[position]).metadata
+            for position in range(store.index.ntotal)
+        ])
+        # Searches share it; in-place adds and tombstoning take it exclusively
+        self.lock = _ReadWriteLock()
+
+    @property
+    def encoding(self):
+        return self.state.encoding
+
+    @property
+    def tombstones(self):
+        return self.state.tombstones
+
+
+class ShardedVectorStore:
+    """FAISS store split into per-file-hash shards, searched concurrently and merged.
+
+    Writes never rewrite a shard: additions go to the shard's delta journal and deletions
+    only to its shard.json. Compaction merges the journal and drops tombstoned vectors.
+    """
+
+    def __init__(self, store_path, embeddings=None, max_loaded_shards=None, max_workers=None,
+                 rescore_factor=DEFAULT_RESCORE_FACTOR):
+        """Open a store. embeddings=None uses the backend recorded in the manifest; explicit
+        embeddings must match it, since vectors from different backends are not comparable."""
+        self.store_path = Path(store_path)
+        self.max_loaded_shards = max_loaded_shards
+        self.max_workers = max_workers
+        # Compressed shards fetch k * rescore_factor candidates and rescore them exactly (0 disables)
+        self.rescore_factor = rescore_factor
+        self._loaded = {}
+        self._states = {}
+        self._access_counts = Counter()
+        # Guards _loaded and the manifest only; never held while embedding, loading or compacting
+        self._lock = threading.RLock()
+        # Per-shard locks serialise loading and writing one shard without blocking the others
+        self._shard_locks = {}
+        self._compactor = None
+        self._dirty = set()
+
+        self.manifest = _read_json(self.store_path / MANIFEST_NAME)
+        if self.manifest is None:
+            if not (self.store_path / "index.faiss").exists():
+                raise FileNotFoundError(f"No vector store found at {self.store_path}")
+            # Legacy monolithic index: expose it as a single read-only shard
+            self.manifest = {
+                "version": MANIFEST_VERSION,
+                "sharding": "legacy",
+                "num_shards": 1,
+                "embedding_model": None,
+                "vector_encoding": "flat",
+                "shards": {"legacy": {"path": ".", "num_vectors": None, "files": []}}
+            }
+
+        recorded = self.embedding_backend
+        if embeddings is None:
+            embeddings = get_embedding_backend(recorded or DEFAULT_EMBEDDING_BACKEND)
+        elif recorded and embedding_identity(embeddings) not in (None, recorded):
+            raise ValueError(
+                f"Vector store at {self.store_path} was built with '{recorded}' embeddings "
+                f"but '{embedding_identity(embeddings)}' was given; rebuild the store or use the same backend."
+            )
+        self.embeddings = embeddings
+
+    @property
+    def embedding_backend(self):
+        """Backend identity the store was built with (older manifests only name an Ollama model)."""
+        if self.manifest.get("embedding_backend"):
+            return self.manifest["embedding_backend"]
+        if self.manifest.get("embedding_model"):
+            return f"ollama/{self.manifest['embedding_model']}"
+        return None
+
+    @property
+    def shard_ids(self):
+        return list(self.manifest["shards"])
+
+    def _shard_dir(self, shard_id):
+        return self.store_path / self.manifest["shards"][shard_id]["path"]
+
+    def _state_locked(self, shard_id):
+        """Write-side state of a shard, read from shard.json once; the caller holds the shard's lock."""
+        state = self._states.get(shard_id)
+        if state is None:
+            state = _ShardState.load(self._shard_dir(shard_id))
+            self._states[shard_id] = state
+        return state
+
+    def _make_shard(self, state, store):
+        full_vectors = None
+        if state.encoding != "flat":
+            base = FullPrecisionVectors(state.shard_dir / state.names["vectors"], state.dim)
+            # Row i must be FAISS position i; rows appended after the last saved index are dropped
+            base.truncate(state.base_vectors)
+            full_vectors = StackedVectors([base, state.journal.vectors])
+        return _Shard(store, state, full_vectors)
+
+    def _check_writable(self):
+        if self.manifest["sharding"] == "legacy":
+            raise ValueError("Cannot modify a legacy monolithic index; rebuild it as a sharded store.")
+
+    def _shard_lock(self, shard_id):
+        # dict.setdefault is atomic, so concurrent callers always get the same lock
+        return self._shard_locks.setdefault(shard_id, threading.Lock())
+
+    def _load_shard(self, shard_id):
+        """Return a loaded shard, loading it lazily and evicting the least used one if over budget."""
+        # Lock-free fast path; a lost increment under contention only skews eviction order
+        self._access_counts[shard_id] += 1
+        shard = self._loaded.get(shard_id)
+        if shard is not None:
+            return shard
+        with self._shard_lock(shard_id):
+            return self._load_shard_locked(shard_id)
+
+    def _load_shard_locked(self, shard_id):
+        """_load_shard for callers already holding the shard's lock."""
+        shard = self._loaded.get(shard_id)
+        if shard is not None:
+            return shard
+        state = self._state_locked(shard_id)
+        ids, documents, vectors = state.journal.read()
+        if self._journal_only(state):
+            # No base segment yet: train on every row the shard has, then replay them all
+            store = FAISS(
+                embedding_function=self.embeddings,
+                index=make_index(state.encoding, state.dim, vectors),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
+        else:
+            store = FAISS.load_local(
+                str(state.shard_dir),
+                self.embeddings,
+                index_name=state.names["index"],
+                allow_dangerous_deserialization=True
+            )
+            if store.index.ntotal != state.base_vectors:
+                raise ValueError(
+                    f"{state.shard_dir} index holds {store.index.ntotal} vectors but shard.json "
+                    f"records {state.base_vectors}; rebuild the shard"
+                )
+        if ids:
+            store.add_embeddings(
+                list(zip([doc.page_content for doc in documents], vectors)),
+                metadatas=[doc.metadata for doc in documents],
+                ids=ids
+            )
+        shard = self._make_shard(state, store)
+        self._register_shard(shard_id, shard)
+        return shard
+
+    @staticmethod
+    def _journal_only(state):
+        """An int8 shard too small to train a base segment on keeps all its vectors in the journal."""
+        return needs_training(state.encoding) and state.base_vectors == 0
+
+    def _register_shard(self, shard_id, shard):
+        with self._lock:
+            if self.max_loaded_shards and len(self._loaded) >= self.max_loaded_shards:
+                # Frequently accessed shards stay pinned; the coldest one is dropped
+                evictable = [s for s in self._loaded if s != shard_id]
+                if evictable:
+                    coldest = min(evictable, key=lambda s: self._access_counts[s])
+                    del self._loaded[coldest]
+            self._loaded[shard_id] = shard
+
+    def preload(self, shard_ids=None):
+        """Load shards up front instead of on first query."""
+        for shard_id in shard_ids or self.shard_ids:
+            self._load_shard(shard_id)
+
+    def _search_shard(self, shard_id, query_vectors, k, filters=None):
+        """Search one shard for a whole query matrix; returns one hit list per query."""
+        shard = self._load_shard(shard_id)
+        num_queries = len(query_vectors)
+        with shard.lock.read():
+            store = shard.store
+            size = store.index.ntotal
+            rescore = shard.full_vectors is not None and self.rescore_factor > 0
+            fetch_k = k * self.rescore_factor if rescore else k
+            if filters:
+                # Pre-filter inside FAISS: only positions matching the metadata and not tombstoned
+                allowed = shard.metadata_index.select(filters)
+                if shard.tombstones:
+                    allowed &= ~bitset_from_positions(shard.tombstones, size)
+                if not allowed:
+                    return [[] for _ in range(num_queries)]
+                if supports_selector(shard.encoding):
+                    selector, _bitmap = bitset_to_selector(allowed, size)
+                    distances, positions = store.index.search(
+                        query_vectors, min(fetch_k, size), params=faiss.SearchParameters(sel=selector)
+                    )
+                    candidates = [zip(d, p) for d, p in zip(distances, positions)]
+                else:
+                    # Binary codes cannot take a selector: score the allowed subset exactly instead
+                    allowed_positions = positions_from_bitset(allowed, size)
+                    candidates = [
+                        zip(shard.full_vectors.distances(query, allowed_positions), allowed_positions)
+                        for query in query_vectors
+                    ]
+                    rescore = False
+            else:
+                # Over-fetch so that tombstoned hits can be dropped without losing top-k
+                fetch = min(fetch_k + len(shard.tombstones), size)
+                if fetch == 0:
+                    return [[] for _ in range(num_queries)]
+                distances, positions = store.index.search(query_vectors, fetch)
+                candidates = [zip(d, p) for d, p in zip(distances, positions)]
+
+            results = []
+            for query, query_candidates in zip(query_vectors, candidates):
+                hits = [
+                    (float(distance), int(position)) for distance, position in query_candidates
+                    if position != -1 and position not in shard.tombstones
+                ]
+                if rescore and hits:
+                    # Exact second stage over the memory-mapped float32 vectors
+                    hit_positions = [position for _, position in hits]
+                    hits = list(zip(shard.full_vectors.distances(query, hit_positions).tolist(), hit_positions))
+                results.append([
+                    (
+                        distance,
+                        shard_id,
+                        store.index_to_docstore_id[position],
+                        store.docstore.search(store.index_to_docstore_id[position])
+                    )
+                    for distance, position in heapq.nsmallest(k, hits)
+                ])
+            return results
+
+    def _candidate_shards(self, filters):
+        """Skip shards that cannot hold any of the requested files."""
+        shard_ids = self.shard_ids
+        wanted = (filters or {}).get("file_name")
+        if wanted is None or isinstance(wanted, tuple) or self.manifest["sharding"] == "legacy":
+            return shard_ids
+        wanted = [wanted] if isinstance(wanted, str) else wanted
+        routed = {shard_for_file(file_name, self.manifest["num_shards"]) for file_name in wanted}
+        return [shard_id for shard_id in shard_ids if shard_id in routed]
+
+    def batch_similarity_search_by_vectors(self, embeddings, k=4, filters=None):
+        """Run one vectorised search per shard over the whole query matrix and merge per query.
+
+        Returns, for each query, a list of (doc, distance, chunk_id) with chunk_id the
+        docstore id, which stays stable across compaction.
+        """
+        query_vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        shard_ids = self._candidate_shards(filters)
+        if not shard_ids or not len(query_vectors):
+            return [[] for _ in range(len(query_vectors))]
+        with ThreadPoolExecutor(max_workers=self.max_workers or min(len(shard_ids), 8)) as pool:
+            per_shard = list(pool.map(lambda s: self._search_shard(s, query_vectors, k, filters), shard_ids))
+        results = []
+        for query_index in range(len(query_vectors)):
+            merged = heapq.nsmallest(
+                k,
+                (hit for shard_hits in per_shard for hit in shard_hits[query_index]),
+                key=lambda hit: hit[0]
+            )
+            results.append([(doc, distance, chunk_id) for distance, _, chunk_id, doc in merged])
+        return results
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filters=None):
+        """Search every candidate shard concurrently and merge the global top-k (lowest L2 distance).
+
+        filters maps file_name / section_type / page_number to a value, a list of values
+        or a (low, high) range; see MetadataIndex.
+        """
+        hits = self.batch_similarity_search_by_vectors([embedding], k, filters)[0]
+        return [(doc, distance) for doc, distance, _ in hits]
+
+    def similarity_search_with_score(self, query, k=4, filters=None):
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k, filters)
+
+    def similarity_search(self, query, k=4, filters=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filters)]
+
+    def _group_by_shard(self, documents):
+        groups = {}
+        for doc in documents:
+            shard_id = shard_for_file(doc.metadata["file_name"], self.manifest["num_shards"])
+            groups.setdefault(shard_id, []).append(doc)
+        return groups
+
+    def _update_manifest(self, shard_ids):
+        """Rewrite the manifest entries of the given shards from their in-memory state."""
+        entries = {}
+        for shard_id in shard_ids:
+            with self._shard_lock(shard_id):
+                entries[shard_id] = self._state_locked(shard_id).manifest_entry()
+        with self._lock:
+            self.manifest["shards"].update(entries)
+            _write_json(self.store_path / MANIFEST_NAME, self.manifest)
+
+    def _embed_groups(self, documents):
+        """Group documents by shard and embed them before any lock is taken."""
+        return {
+            shard_id: (docs, self.embeddings.embed_documents([doc.page_content for doc in docs]))
+            for shard_id, docs in self._group_by_shard(documents).items()
+        }
+
+    def _add_to_shard(self, shard_id, docs, vectors, persist=True):
+        """Append pre-embedded documents; the caller holds the shard's lock.
+
+        A new shard is built directly; an existing one gets the documents appended to its
+        delta journal, so the cost is proportional to the documents, not to the shard.
+        A new int8 shard with too few documents to train on starts out journal-only.
+        """
+        if shard_id not in self.manifest["shards"]:
+            shard_dir = self.store_path / SHARDS_DIR / shard_id
+            encoding = self.manifest.get("vector_encoding", "flat")
+            if not needs_training(encoding) or len(docs) >= MIN_TRAINING_VECTORS:
+                store = build_shard(shard_dir, docs, self.embeddings, encoding, vectors)
+                state = _ShardState.load(shard_dir)
+                self._states[shard_id] = state
+                self._register_shard(shard_id, self._make_shard(state, store))
+                with self._lock:
+                    self.manifest["shards"][shard_id] = state.manifest_entry()
+                return
+            shard_dir.mkdir(parents=True, exist_ok=True)
+            _remove_segments(shard_dir)
+            state = _ShardState(shard_dir, {"encoding": encoding, "dim": len(vectors[0]), "base_vectors": 0})
+            state.save()
+            self._states[shard_id] = state
+            with self._lock:
+                self.manifest["shards"][shard_id] = state.manifest_entry()
+        state = self._state_locked(shard_id)
+        ids = [str(uuid.uuid4()) for _ in docs]
+        start = state.num_positions
+        # Durable before it becomes visible; a loaded shard gets the same ids in memory
+        state.journal.append(ids, docs, vectors)
+        shard = self._loaded.get(shard_id)
+        if shard is not None and self._journal_only(state):
+            # Its index was trained on the rows present at load; reloading retrains on all of them
+            with self._lock:
+                self._loaded.pop(shard_id, None)
+            shard = None
+        if shard is not None:
+            # Searches are only blocked for the in-memory append itself
+            with shard.lock.write():
+                shard.store.add_embeddings(
+                    list(zip([doc.page_content for doc in docs], vectors)),
+                    metadatas=[doc.metadata for doc in docs],
+                    ids=ids
+                )
+                shard.metadata_index.add([doc.metadata for doc in docs])
+        for file_name, ranges in _file_ranges(docs, start).items():
+            _extend_ranges(state.files.setdefault(file_name, []), ranges)
+        if persist:
+            state.save()
+        else:
+            with self._lock:
+                self._dirty.add(shard_id)
+
+    def _tombstone_file(self, shard_id, file_name):
+        """Tombstone a file's vectors in memory; the caller holds the shard's lock."""
+        if shard_id not in self.manifest["shards"]:
+            return 0
+        state = self._state_locked(shard_id)
+        shard = self._loaded.get(shard_id)
+        with shard.lock.write() if shard is not None else nullcontext():
+            ranges = state.files.pop(file_name, [])
+            state.tombstones.update(_positions(ranges))
+        state.tombstone_ranges.extend(ranges)
+        return _range_count(ranges)
+
+    def add_documents(self, documents, persist=True):
+        """Append documents to the shards their source files route to.
+
+        With persist=False shard.json and the manifest are only written on flush(), so
+        streaming ingestion appends to the journals without rewriting metadata per batch.
+        """
+        self._check_writable()
+        touched = []
+        for shard_id, (docs, vectors) in self._embed_groups(documents).items():
+            with self._shard_lock(shard_id):
+                self._add_to_shard(shard_id, docs, vectors, persist)
+            touched.append(shard_id)
+        if persist:
+            self._update_manifest(touched)
+
+    def flush(self):
+        """Persist the shard.json and manifest entries of shards written with persist=False."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for shard_id in dirty:
+            with self._shard_lock(shard_id):
+                self._state_locked(shard_id).save()
+        self._update_manifest(dirty)
+
+    def delete_file(self, file_name):
+        """Tombstone every vector of a source file; returns the number of vectors removed.
+
+        Only the shard's shard.json is written; manifest counts catch up on the next
+        add, flush or compaction.
+        """
+        self._check_writable()
+        shard_id = shard_for_file(file_name, self.manifest["num_shards"])
+        with self._shard_lock(shard_id):
+            removed = self._tombstone_file(shard_id, file_name)
+            if removed:
+                self._state_locked(shard_id).save()
+        return removed
+
+    def upsert_documents(self, documents):
+        """Replace all vectors of each document's source file."""
+        self._check_writable()
+        touched = []
+        for shard_id, (docs, vectors) in self._embed_groups(documents).items():
+            with self._shard_lock(shard_id):
+                for file_name in {doc.metadata["file_name"] for doc in docs}:
+                    self._tombstone_file(shard_id, file_name)
+                self._add_to_shard(shard_id, docs, vectors)
+            touched.append(shard_id)
+        self._update_manifest(touched)
+
+    def compact_shard(self, shard_id):
+        """Merge a shard's delta journal into a new base segment without its tombstoned
+        vectors and swap it in atomically. Returns the number of vectors dropped.
+
+        The new generation's files are written next to the old ones and shard.json, written
+        last, switches over. Writers to this shard wait; searches keep using the old index.
+        Compressed shards are re-encoded from their float32 rows, so int8 is retrained on
+        every vector kept; an int8 shard left too small to train on goes back to the journal.
+        """
+        with self._shard_lock(shard_id):
+            shard = self._load_shard_locked(shard_id)
+            state = shard.state
+            if not state.tombstones and not state.journal.count:
+                return 0
+            old = shard.store
+            with shard.lock.read():
+                size = old.index.ntotal
+                tombstones = set(state.tombstones)
+                # Compaction works on a copy so that searches keep using the old index meanwhile
+                index = faiss.clone_index(old.index) if shard.full_vectors is None else None
+            kept = [pos for pos in range(size) if pos not in tombstones]
+            rows = None
+            if index is None:
+                rows = shard.full_vectors.rows(kept)
+                index = make_index(state.encoding, state.dim, rows)
+                if kept:
+                    index.add(rows)
+            elif tombstones:
+                index.remove_ids(np.fromiter(sorted(tombstones), dtype=np.int64))
+            journal_only = needs_training(state.encoding) and len(kept) < MIN_TRAINING_VECTORS
+            new_position = {old_pos: new_pos for new_pos, old_pos in enumerate(kept)}
+            docstore = InMemoryDocstore({
+                old.index_to_docstore_id[pos]: old.docstore.search(old.index_to_docstore_id[pos])
+                for pos in kept
+            })
+            store = FAISS(
+                embedding_function=old.embedding_function,
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id={new_pos: old.index_to_docstore_id[old_pos] for old_pos, new_pos in new_position.items()},
+                normalize_L2=old._normalize_L2,
+                distance_strategy=old.distance_strategy
+            )
+            generation = state.generation + 1
+            names = _segment_names(generation)
+            # Leftovers of an earlier compaction to this generation that never committed
+            _remove_segments(state.shard_dir, state.generation)
+            if journal_only:
+                if kept:
+                    _DeltaJournal(state.shard_dir, names["delta"], state.dim).append(
+                        [old.index_to_docstore_id[pos] for pos in kept],
+                        [docstore.search(old.index_to_docstore_id[pos]) for pos in kept],
+                        rows
+                    )
+            else:
+                if rows is not None:
+                    FullPrecisionVectors(state.shard_dir / names["vectors"], state.dim).append(rows)
+                store.save_local(str(state.shard_dir), index_name=names["index"])
+            compacted_state = _ShardState(state.shard_dir, {
+                "encoding": state.encoding,
+                "generation": generation,
+                "dim": state.dim,
+                "base_vectors": 0 if journal_only else len(kept),
+                "file_ranges": {
+                    file_name: _ranges(new_position[pos] for pos in _positions(ranges))
+                    for file_name, ranges in state.files.items()
+                }
+            })
+            compacted_state.save()
+            compacted = self._make_shard(compacted_state, store)
+            self._states[shard_id] = compacted_state
+            with self._lock:
+                self._loaded[shard_id] = compacted
+            _remove_segments(state.shard_dir, generation)
+        self._update_manifest([shard_id])
+        return len(tombstones)
+
+    def maybe_compact(self, threshold=DEFAULT_COMPACTION_THRESHOLD):
+        """Compact every shard whose tombstone or journal share has reached the threshold."""
+        compacted = {}
+        if self.manifest["sharding"] == "legacy":
+            return compacted
+        for shard_id in self.shard_ids:
+            with self._shard_lock(shard_id):
+                state = self._state_locked(shard_id)
+                total, dead, delta = state.num_positions, len(state.tombstones), state.journal.count
+                if self._journal_only(state) and total < MIN_TRAINING_VECTORS:
+                    # Nothing to merge the journal into until there is enough to train a base on
+                    delta = 0
+            if (dead or delta) and max(dead, delta) / total >= threshold:
+                compacted[shard_id] = self.compact_shard(shard_id)
+        return compacted
+
+    def compact_in_background(self, threshold=DEFAULT_COMPACTION_THRESHOLD):
+        """Schedule maybe_compact on a background thread; returns a Future."""
+        if self._compactor is None:
+            self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="compaction")
+        return self._compactor.submit(self.maybe_compact, threshold)
+
+    def full_precision_vectors(self, max_vectors=None, seed=0):
+        """Collect live float32 vectors from every shard (optionally a random sample)."""
+        blocks = []
+        for shard_id in self.shard_ids:
+            shard = self._load_shard(shard_id)
+            with shard.lock.read():
+                size = shard.store.index.ntotal
+                live = np.array([p for p in range(size) if p not in shard.tombstones], dtype=np.int64)
+                if not len(live):
+                    continue
+                if shard.full_vectors is not None:
+                    blocks.append(shard.full_vectors.rows(live))
+                else:
+                    blocks.append(shard.store.index.reconstruct_n(0, size)[live])
+        if not blocks:
+            return np.empty((0, 0), dtype=np.float32)
+        vectors = np.vstack(blocks)
+        if max_vectors and len(vectors) > max_vectors:
+            vectors = vectors[np.random.default_rng(seed).choice(len(vectors), max_vectors, replace=False)]
+        return vectors
+
+    def close(self):
+        """Wait for any background compaction to finish."""
+        if self._compactor is not None:
+            self._compactor.shutdown(wait=True)
+            self._compactor = None
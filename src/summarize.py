@@ -1,25 +1,46 @@
-from langchain_ollama import OllamaLLM
+import time
 from rouge_score import rouge_scorer
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from tqdm import tqdm
 
+try:
+    from src.model_registry import get_llm
+    from src.chunk_sizing import get_sizer, resolve_context_tokens
+    from src.utils import count_tokens
+except ImportError:
+    from model_registry import get_llm
+    from chunk_sizing import get_sizer, resolve_context_tokens
+    from utils import count_tokens
+
+
+MODEL = "llama3:8b"
+OVERLAP_TOKENS = 50
+# Expected summary length relative to its input; reserves room for the output in the context
+OUTPUT_RATIOS = {"abstractive": 0.3, "extractive": 0.4}
+
+def get_summary_llm():
+    # num_ctx is set explicitly so chunks sized to the model's window are not silently truncated
+    return get_llm(MODEL, temperature=0.3, num_ctx=resolve_context_tokens(MODEL))
+
+def get_summary_sizer(strategy):
+    return get_sizer(
+        f"summarize_{strategy}",
+        model=MODEL,
+        prompt_overhead_tokens=count_tokens(build_prompt("", strategy)),
+        output_ratio=OUTPUT_RATIOS.get(strategy, 0.3),
+        overlap_tokens=OVERLAP_TOKENS
+    )
 
-llm = OllamaLLM(model="llama3:8b", temperature=0.3)
-
-def split_text(text, max_length=8000):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=max_length,
-        chunk_overlap=200,
-        length_function=len,
+def split_text(text, max_tokens, overlap_tokens=OVERLAP_TOKENS):
+    splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=max_tokens,
+        chunk_overlap=overlap_tokens,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
     return splitter.split_text(text)
 
-def summarize_chunk(chunk, strategy="abstractive"):
-    chunk = chunk.strip()
-    if not chunk:
-        return ""
-
+def build_prompt(chunk, strategy="abstractive"):
     if strategy == "abstractive":
         prompt = f"""
         You are a highly intelligent summarization system. strictly give the target text only.
@@ -40,24 +61,40 @@ def summarize_chunk(chunk, strategy="abstractive"):
         """
     else:
         prompt = f"Extract the most important sentences from this passage:\n\n{chunk}\n\nExtracted Summary:"
+    return prompt
+
+def summarize_chunk(chunk, strategy="abstractive"):
+    chunk = chunk.strip()
+    if not chunk:
+        return ""
 
-    return llm.invoke(prompt).strip()
+    start = time.time()
+    summary = get_summary_llm().invoke(build_prompt(chunk, strategy)).strip()
+    # Feed the observed call cost back into chunk sizing
+    get_summary_sizer(strategy).record(count_tokens(chunk), count_tokens(summary), time.time() - start)
+    return summary
 
 
-def recursive_summarize(texts, strategy="abstractive", max_length=8000, depth=0, max_depth=10):
+def recursive_summarize(texts, strategy="abstractive", max_tokens=None, depth=0, max_depth=10):
     print(f"\n📚 Summarizing {len(texts)} chunks at depth {depth}...")
     summaries = [summarize_chunk(text, strategy) for text in tqdm(texts) if text.strip()]
     combined = "\n\n".join(summaries)
 
-    if len(combined) > max_length and depth < max_depth:
-        chunks = split_text(combined, max_length)
-        return recursive_summarize(chunks, strategy, max_length, depth + 1, max_depth)
+    sizer = get_summary_sizer(strategy)
+    combined_tokens = count_tokens(combined)
+    if combined_tokens > (max_tokens or sizer.max_chunk_tokens()) and depth < max_depth:
+        chunks = split_text(combined, max_tokens or sizer.chunk_tokens(combined_tokens))
+        return recursive_summarize(chunks, strategy, max_tokens, depth + 1, max_depth)
     else:
         return summarize_chunk(combined, strategy)
 
-def summarize_text(text, strategy="abstractive", max_length=8000):
-    chunks = split_text(text, max_length)
-    return recursive_summarize(chunks, strategy, max_length)
+def summarize_text(text, strategy="abstractive", max_tokens=None):
+    """Summarize text; chunks are sized in tokens from the model context unless max_tokens is given."""
+    sizer = get_summary_sizer(strategy)
+    chunk_size = max_tokens or sizer.chunk_tokens(count_tokens(text))
+    print(f"📏 Chunk size {chunk_size} tokens (context {sizer.context_tokens}, {sizer.tokens_per_second:.1f} output tokens/sec observed)")
+    chunks = split_text(text, chunk_size)
+    return recursive_summarize(chunks, strategy, max_tokens)
 
 def evaluate_summary(reference, summary):
     scorer = rouge_scorer.RougeScorer(['rouge1', 'rouge2', 'rougeL'], use_stemmer=True)
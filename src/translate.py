@@ -1,19 +1,55 @@
+import time
 from langdetect import detect, LangDetectException
-from langchain_ollama import OllamaLLM
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-llm = OllamaLLM(model="llama3:8b", temperature=0.3)
+try:
+    from src.model_registry import get_llm
+    from src.chunk_sizing import get_sizer, resolve_context_tokens
+    from src.utils import count_tokens
+except ImportError:
+    from model_registry import get_llm
+    from chunk_sizing import get_sizer, resolve_context_tokens
+    from utils import count_tokens
 
-def translate_text(text, target_lang="en", max_length=3500):
+MODEL = "llama3:8b"
+OVERLAP_TOKENS = 25
+# Translations into these languages take noticeably more tokens than the source text
+OUTPUT_RATIOS = {"ar": 2.0}
+DEFAULT_OUTPUT_RATIO = 1.3
+
+def build_prompt(chunk, source_lang, target_lang):
+    return f"""
+        Translate and improve the fluency of the following text from {source_lang} to {target_lang}. 
+        Maintain original meaning, structure, and tone. Return only the translated and refined version.
+        strictly give the target text only.
+
+        Text:
+        \"\"\"{chunk}\"\"\"
+        """
+
+def get_translation_sizer(source_lang, target_lang):
+    return get_sizer(
+        f"translate_{target_lang}",
+        model=MODEL,
+        prompt_overhead_tokens=count_tokens(build_prompt("", source_lang, target_lang)),
+        output_ratio=OUTPUT_RATIOS.get(target_lang, DEFAULT_OUTPUT_RATIO),
+        overlap_tokens=OVERLAP_TOKENS
+    )
+
+def translate_text(text, target_lang="en", max_tokens=None):
+    """Translate text; chunks are sized in tokens from the model context unless max_tokens is given."""
     try:
         source_lang = detect(text)
     except LangDetectException:
         return "Unable to detect source language."
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=max_length,
-        chunk_overlap=100,
-        length_function=len,
+    sizer = get_translation_sizer(source_lang, target_lang)
+    # num_ctx is set explicitly so chunks sized to the model's window are not silently truncated
+    llm = get_llm(MODEL, temperature=0.3, num_ctx=resolve_context_tokens(MODEL))
+    splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=max_tokens or sizer.chunk_tokens(count_tokens(text)),
+        chunk_overlap=OVERLAP_TOKENS,
         separators=["\n\n", "\n", ". ", " ", ""]
     )
 
@@ -21,16 +57,10 @@ def translate_text(text, target_lang="en", max_length=3500):
     results = []
 
     for i, chunk in enumerate(chunks, 1):
-        prompt = f"""
-        Translate and improve the fluency of the following text from {source_lang} to {target_lang}. 
-        Maintain original meaning, structure, and tone. Return only the translated and refined version.
-        strictly give the target text only.
-
-        Text:
-        \"\"\"{chunk}\"\"\"
-        """
+        start = time.time()
         try:
-            translated = llm.invoke(prompt).strip()
+            translated = llm.invoke(build_prompt(chunk, source_lang, target_lang)).strip()
+            sizer.record(count_tokens(chunk), count_tokens(translated), time.time() - start)
         except Exception as e:
             translated = f"[Error in chunk {i}: {e}]"
 
@@ -3,6 +3,34 @@ import time
 import tiktoken
 import json
 
+try:
+    from src.profiling import profile_stage
+except ImportError:
+    from profiling import profile_stage
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(text):
+    """Count cl100k_base tokens (close to llama3's tokenizer)."""
+    return len(_get_encoding().encode(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens."""
+    tokens = _get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return _get_encoding().decode(tokens[:max_tokens]) + " ..."
+
+
 def save_text(text, output_path):
     """Save text to a file, creating directories if needed."""
     try:
@@ -15,14 +43,17 @@ def save_text(text, output_path):
         print(f"Error saving text to {output_path}: {e}")
 
 
-def measure_performance(text, task_func, task_name):
-    """Measure tokens per second for a task."""
-    import tiktoken
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = len(encoding.encode(text))
+def measure_performance(text, task_func, task_name, stage=None):
+    """Measure tokens per second for a task.
+
+    Profiled as stage (default task_name), with task_name as the call's detail, so that
+    per-file task names still aggregate under one profiling stage.
+    """
+    tokens = count_tokens(text)
 
     start_time = time.time()
-    result = task_func(text)
+    with profile_stage(stage or task_name, task_name if stage else None):
+        result = task_func(text)
     elapsed_time = time.time() - start_time
     tokens_per_second = tokens / elapsed_time if elapsed_time > 0 else 0
 
@@ -43,3 +74,14 @@ def measure_performance(text, task_func, task_name):
 
     return result
 
+
+def batched(iterable, batch_size):
+    """Group an iterable into lists of at most batch_size items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
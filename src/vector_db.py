@@ -1,50 +1,54 @@
-import json
 import os
 from pathlib import Path
-from langchain_community.vectorstores import FAISS
-from langchain_ollama import OllamaEmbeddings
-from langchain_core.documents import Document
-
-def create_vector_db(chunks, model_name="nomic-embed-text"):
-    """Create FAISS vector database from chunks using LangChain's FAISS.from_documents."""
+try:
+    from src.chunk_store import ChunkStore
+    from src.sharded_store import DEFAULT_NUM_SHARDS, ShardedVectorStore, build_sharded_store, chunk_to_document, chunks_to_documents
+    from src.embedding_backends import get_embedding_backend
+except ImportError:
+    from chunk_store import ChunkStore
+    from sharded_store import DEFAULT_NUM_SHARDS, ShardedVectorStore, build_sharded_store, chunk_to_document, chunks_to_documents
+    from embedding_backends import get_embedding_backend
+
+def create_vector_db(chunks, model_name="nomic-embed-text", num_shards=DEFAULT_NUM_SHARDS, max_workers=None, encoding="flat",
+                     embedding_backend=None):
+    """Create a sharded FAISS vector database from chunks, building shards in parallel.
+
+    chunks may be any iterable of chunk dicts, e.g. ChunkStore.iter_chunks(); it is
+    consumed and embedded in batches rather than loaded at once.
+    encoding selects how vectors are held in the index: flat (float32), fp16, int8 or binary.
+    embedding_backend ('ollama/<model>' or 'hashing[/<dim>]') defaults to the Ollama model_name.
+    """
     try:
-        # Initialize embeddings
-        embeddings = OllamaEmbeddings(model=model_name)
-
-        # Convert chunks to LangChain Document objects
-        documents = [
-            Document(
-                page_content=chunk["text"],
-                metadata={
-                    "file_name": chunk["file_name"],
-                    "chunk_number": chunk["chunk_number"]
-                }
-            )
-            for chunk in chunks
-        ]
+        # Embedding backend; Ollama clients are shared through the model registry
+        embeddings = get_embedding_backend(embedding_backend or f"ollama/{model_name}")
 
-        # Create FAISS vector store from documents
-        vector_db = FAISS.from_documents(documents, embeddings)
+        # Convert chunks to LangChain Document objects lazily, one batch at a time
+        documents = map(chunk_to_document, chunks)
 
-        # Save index
+        # Build one FAISS index per shard and write the manifest
         base_dir = Path(__file__).parent.parent
         output_dir = base_dir / "outputs"
         output_dir.mkdir(parents=True, exist_ok=True)
-        vector_db.save_local(output_dir / "vector_db")
+        build_sharded_store(
+            documents,
+            embeddings,
+            output_dir / "vector_db",
+            num_shards=num_shards,
+            max_workers=max_workers,
+            embedding_model=embeddings.model,
+            encoding=encoding
+        )
 
-        return vector_db
+        return ShardedVectorStore(output_dir / "vector_db", embeddings)
 
     except Exception as e:
         print(f"Error creating vector database: {e}")
         return None
 
-def add_chunk_to_vector_db(chunk, model_name="nomic-embed-text"):
-    """Add a single chunk to an existing FAISS vector database."""
+def add_chunk_to_vector_db(chunk, embedding_backend=None):
+    """Add a single chunk to its shard in an existing vector database."""
     try:
-        # Initialize embeddings
-        embeddings = OllamaEmbeddings(model=model_name)
-
-        # Load existing FAISS vector store
+        # Load existing sharded vector store
         base_dir = Path(__file__).parent.parent
         output_dir = base_dir / "outputs"
         vector_db_path = output_dir / "vector_db"
@@ -53,26 +57,11 @@ def add_chunk_to_vector_db(chunk, model_name="nomic-embed-text"):
             print(f"Vector database at '{vector_db_path}' does not exist.")
             return False
 
-        vector_db = FAISS.load_local(
-            vector_db_path,
-            embeddings,
-            allow_dangerous_deserialization=True
-        )
-
-        # Convert chunk to LangChain Document
-        document = Document(
-            page_content=chunk["text"],
-            metadata={
-                "file_name": chunk["file_name"],
-                "chunk_number": chunk["chunk_number"]
-            }
-        )
-
-        # Add document to vector store
-        vector_db.add_documents([document])
+        # Embeds with the backend recorded in the manifest unless one is given
+        vector_db = ShardedVectorStore(vector_db_path, get_embedding_backend(embedding_backend) if embedding_backend else None)
 
-        # Save updated vector store
-        vector_db.save_local(vector_db_path)
+        # Add document to the shard its file routes to
+        vector_db.add_documents(chunks_to_documents([chunk]))
 
         print(f"Successfully added chunk {chunk['chunk_number']} from {chunk['file_name']} to vector database.")
         return True
@@ -85,23 +74,14 @@ if __name__ == "__main__":
     base_dir = Path(__file__).parent.parent
     chunks_dir = base_dir / "outputs" / "chunks"
 
-    # Load all chunks for initial creation
-    all_chunks = []
-    if not chunks_dir.exists():
+    # Stream live chunks from the binary chunk store (text decoded straight from the mmap)
+    chunk_store = ChunkStore(chunks_dir) if chunks_dir.exists() else None
+    if chunk_store is None:
         print(f"Directory '{chunks_dir}' does not exist.")
-    else:
-        for file_path in chunks_dir.rglob("*.json"):
-            print(f"Loading chunks from: {file_path}")
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    chunks = json.load(f)
-                    all_chunks.extend(chunks)
-            except Exception as e:
-                print(f"Error loading {file_path}: {e}")
-
-    if all_chunks:
-        print(f"Generating embeddings for {len(all_chunks)} chunks...")
-        vector_db = create_vector_db(all_chunks)
+    elif len(chunk_store):
+        print(f"Generating embeddings for the live chunks in: {chunks_dir}")
+        vector_db = create_vector_db(chunk_store.iter_chunks())
+        chunk_store.close()
         if vector_db:
             print("Vector database created successfully.")
         else: